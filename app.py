@@ -1,8 +1,17 @@
-from app.bot import run_bot
+import asyncio
+
 from app.config import Config
+from app.logs import configure_logging
 
 def main():
-    run_bot()
+    configure_logging()
+    config = Config.load_config()
+    if config['bot_async']:
+        from app.async_bot import run_async_bot
+        asyncio.run(run_async_bot())
+    else:
+        from app.bot import run_bot
+        run_bot()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AlbumCollector:
+    """Group messages sharing a `media_group_id` into one batch.
+
+    Telegram delivers each file of an album as a separate message. Items are
+    buffered until no new file arrives for `window` seconds (or `max_items`
+    are collected), then `on_ready(items)` is called from a timer thread with
+    the items in message order.
+    """
+
+    def __init__(self, on_ready, window=1.5, max_items=10):
+        self.on_ready = on_ready
+        self.window = window
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def add(self, group_id, message_id, item):
+        """Buffer item and restart the group's collection window."""
+        with self._lock:
+            timer, items = self._groups.get(group_id, (None, []))
+            if timer:
+                timer.cancel()
+            items.append((message_id, item))
+            if len(items) >= self.max_items:
+                self._groups.pop(group_id, None)
+                timer = None
+            else:
+                timer = threading.Timer(self.window, self._flush, args=(group_id,))
+                timer.daemon = True
+                self._groups[group_id] = (timer, items)
+        if timer:
+            timer.start()
+        else:
+            self._dispatch(group_id, items)
+
+    def _flush(self, group_id):
+        with self._lock:
+            _, items = self._groups.pop(group_id, (None, None))
+        if items:
+            self._dispatch(group_id, items)
+
+    def _dispatch(self, group_id, items):
+        items.sort(key=lambda pair: pair[0])
+        logger.debug("Collected album %s with %s items", group_id, len(items))
+        try:
+            self.on_ready([item for _, item in items])
+        except Exception:
+            logger.exception("Could not process album %s", group_id)
+
+
+class AsyncAlbumCollector:
+    """`AlbumCollector` for a single asyncio event loop; `on_ready` is a coroutine."""
+
+    def __init__(self, on_ready, window=1.5, max_items=10):
+        self.on_ready = on_ready
+        self.window = window
+        self.max_items = max_items
+        self._groups = {}
+        self._tasks = set() # the loop keeps only weak references to tasks
+
+    def add(self, group_id, message_id, item):
+        handle, items = self._groups.get(group_id, (None, []))
+        if handle:
+            handle.cancel()
+        items.append((message_id, item))
+        loop = asyncio.get_running_loop()
+        if len(items) >= self.max_items:
+            self._groups.pop(group_id, None)
+            self._start(group_id, items)
+        else:
+            handle = loop.call_later(self.window, self._flush, group_id)
+            self._groups[group_id] = (handle, items)
+
+    def _flush(self, group_id):
+        _, items = self._groups.pop(group_id, (None, None))
+        if items:
+            self._start(group_id, items)
+
+    def _start(self, group_id, items):
+        task = asyncio.get_running_loop().create_task(self._dispatch(group_id, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, group_id, items):
+        items.sort(key=lambda pair: pair[0])
+        logger.debug("Collected album %s with %s items", group_id, len(items))
+        try:
+            await self.on_ready([item for _, item in items])
+        except Exception:
+            logger.exception("Could not process album %s", group_id)
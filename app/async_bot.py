@@ -0,0 +1,340 @@
+import asyncio
+from datetime import datetime
+import logging
+import time
+import uuid
+
+from telebot import util
+from telebot.async_telebot import AsyncTeleBot
+
+from app.albums import AsyncAlbumCollector
+from app.bot import check_document_type, decode_page, page_markup
+from app.cache import LRUCache
+from app.config import Config
+import app.async_database as async_database
+import app.database as database
+import app.jobs as jobs
+import app.metrics as metrics
+import app.trends as trends
+from app.intent import parse_intent, parse_trend
+from app.llm import chat_async, chat_sessions
+from app.pipeline import create_pipeline, document_label, ingest_reply
+
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+
+async def run_async_bot():
+    """Run telegram bot on a single event loop.
+
+    Network I/O (Telegram, Groq, Postgres) is awaited directly, while OCR,
+    PDF conversion and the remaining synchronous database helpers run in
+    executor threads so they never block the loop.
+    """
+    bot = AsyncTeleBot(config['bot_token'])
+    loop = asyncio.get_running_loop()
+    query_pages = metrics.track_cache('query_pages', LRUCache(config['query_page_cache_size']))
+    ingestion_slots = asyncio.Semaphore(config['ingestion_workers'])
+    ingestion_tasks = set()
+    durable = config['ingestion_backend'] == 'postgres'
+    pipeline = create_pipeline()
+
+    async def answer_query(message, query_type, document_type, dates, latest=False, abnormal=False):
+        """Search database for the parsed query and send the first page."""
+        query = {
+            'query_type': query_type,
+            'document_type': document_type,
+            'start_date': dates[0],
+            'end_date': dates[1],
+            'latest': latest,
+            'abnormal': abnormal
+        }
+        token = uuid.uuid4().hex[:12]
+        query_pages.put(token, (message.chat.id, query))
+        await send_query_page(message, token, query)
+
+    async def send_query_page(message, token, query, cursor=None, backward=False):
+        """Send one page of query results with navigation buttons."""
+        try:
+            with metrics.message_span('query'):
+                data, previous_cursor, next_cursor = await async_database.fetch_page(
+                    message.chat.id, **query, cursor=cursor, backward=backward
+                )
+        except Exception as e:
+            logger.error(f"Query error: {e}")
+            raise Exception(f"Ошибка запроса: {e}")
+        if not data:
+            raise Exception("Ошибка запроса: Не найдено данных за указанный период.")
+
+        markup = page_markup(token, previous_cursor, next_cursor)
+        chunks = util.smart_split(data)
+        for number, text in enumerate(chunks, start=1):
+            await bot.send_message(
+                message.chat.id,
+                text,
+                reply_markup=markup if number == len(chunks) else None
+            )
+
+    async def handle_queries(message, query_string):
+        """Parse the query and search database."""
+        try:
+            query_type, document_type, dates = database.parse_query(query_string)
+        except Exception as e:
+            logger.error(f"Query error: {e}")
+            raise Exception(f"Ошибка запроса: {e}")
+        await answer_query(message, query_type, document_type, dates)
+
+    @bot.callback_query_handler(func=lambda call: call.data and call.data.startswith('page:'))
+    async def page_callback(call):
+        """Fetch previous or next page of query results on demand."""
+        token, backward, cursor = decode_page(call.data)
+        stored = query_pages.get(token)
+        if not stored or stored[0] != call.message.chat.id:
+            await bot.answer_callback_query(call.id, "Запрос устарел, повторите его.")
+            return
+        _, query = stored
+        await bot.answer_callback_query(call.id)
+        await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+        try:
+            await send_query_page(call.message, token, query, cursor, backward)
+        except Exception as e:
+            await bot.send_message(call.message.chat.id, f"Ошибка: {e}")
+
+    @bot.message_handler(commands=['start'])
+    async def start(message):
+        """Greet user and set up database."""
+        username = message.from_user.first_name
+        prompt = (
+            f"Кратко поприветствуй пользователя"
+            f"{username}, представься и жди комманд."
+            )
+        chat_sessions.reset(message.chat.id)
+        response = await chat_async(prompt)
+        if response:
+            await bot.reply_to(message, response)
+        await asyncio.to_thread(database.create_database_tables)
+
+    @bot.message_handler(content_types=['photo'])
+    async def handle_photo(message):
+        """Ask user to send uncompressed images."""
+        if message.photo:
+            await bot.reply_to(message, "Пожалуйста, прикрепите изображение как документ.")
+
+    def make_progress_reporter(status_message, interval=1.0):
+        """Return thread-safe callback editing the status message with page progress."""
+        last_edit = 0.0
+
+        def report(done, total):
+            nonlocal last_edit
+            now = time.monotonic()
+            if done < total and now - last_edit < interval:
+                return
+            last_edit = now
+            asyncio.run_coroutine_threadsafe(
+                edit_status(status_message, f"Обрабатываю документ: страница {done} из {total}..."),
+                loop
+            )
+
+        return report
+
+    async def edit_status(status_message, text):
+        try:
+            await bot.edit_message_text(text, status_message.chat.id, status_message.message_id)
+        except Exception as e:
+            logger.debug(f"Could not update status message: {e}")
+
+    async def download(message):
+        """Download file attached to the message."""
+        file_info = await bot.get_file(message.document.file_id)
+        return await bot.download_file(file_info.file_path)
+
+    async def process_document(message, doc_type, status_message, trace):
+        """Download attached document and store it."""
+        with trace.span('download'):
+            downloaded_file = await download(message)
+        on_progress = make_progress_reporter(status_message)
+        return await ingest_files(message, [downloaded_file], [doc_type], trace, on_progress)
+
+    async def process_album(messages, doc_types, status_message, trace):
+        """Store all files of an album as a single document with one extraction."""
+        with trace.span('download'):
+            files = await asyncio.gather(*(download(message) for message in messages))
+        return await ingest_files(messages[0], list(files), doc_types, trace)
+
+    async def ingest_files(message, files, doc_types, trace, on_progress=None):
+        """Run the shared document pipeline in a thread and reply with its outcome.
+
+        Returns the document's data format for metrics.
+        """
+        document_id, data_format = await asyncio.to_thread(
+            pipeline.ingest, message.chat.id, files, doc_types, trace, on_progress
+        )
+        await bot.reply_to(message, ingest_reply(document_id))
+        return data_format
+
+    async def ingest(process, message, doc_types, *args):
+        """Run `process(*args, trace)` once an ingestion slot is free, reporting errors to `message`."""
+        trace = metrics.Trace(document_label(doc_types))
+        queued_at = time.perf_counter()
+        async with ingestion_slots:
+            start = time.perf_counter()
+            trace.add('queue_wait', start - queued_at)
+            data_format = None
+            try:
+                data_format = await process(*args, trace)
+            except Exception as e:
+                logger.exception("Ingestion failed")
+                await bot.reply_to(message, f"Ошибка обработки документа: {e}")
+            finally:
+                trace.add('total', time.perf_counter() - start)
+                trace.finish(data_format)
+
+    @bot.message_handler(commands=['status'])
+    async def status(message):
+        """Report number of documents being processed."""
+        if durable:
+            depth = await asyncio.to_thread(jobs.depth)
+            await bot.reply_to(message, f"Документов в очереди: {depth}")
+            return
+        await bot.reply_to(message, f"Документов в обработке: {len(ingestion_tasks)}")
+
+    async def persist_job(message, status_text, files):
+        """Hand (file_id, doc_type) pairs over to worker.py processes via the job table."""
+        if await asyncio.to_thread(jobs.depth) >= config['ingestion_queue_size']:
+            metrics.errors_total.inc(stage='queue_full')
+            await bot.reply_to(message, "Сервер перегружен, попробуйте прислать документ позже.")
+            return
+        status_message = await bot.reply_to(message, status_text)
+        job_id = await asyncio.to_thread(
+            jobs.enqueue, message.chat.id, message.message_id, files, status_message.message_id
+        )
+        await edit_status(status_message, f"Обрабатываю документ (№{job_id})...")
+
+    async def start_ingestion(message, status_text, doc_types, process, *args):
+        """Start background processing task unless too many are running."""
+        if len(ingestion_tasks) >= config['ingestion_queue_size']:
+            metrics.errors_total.inc(stage='queue_full')
+            await bot.reply_to(message, "Сервер перегружен, попробуйте прислать документ позже.")
+            return
+        status_message = await bot.reply_to(message, status_text)
+        task = asyncio.create_task(ingest(process, message, doc_types, *args, status_message))
+        ingestion_tasks.add(task)
+        task.add_done_callback(ingestion_tasks.discard)
+
+    async def handle_album(items):
+        """Process collected album files as one document."""
+        messages, doc_types = zip(*items)
+        status_text = f"Обрабатываю альбом из {len(messages)} файлов..."
+        if durable:
+            files = [(message.document.file_id, doc_type) for message, doc_type in items]
+            await persist_job(messages[0], status_text, files)
+            return
+        await start_ingestion(
+            messages[0], status_text, doc_types,
+            process_album, list(messages), list(doc_types)
+        )
+
+    album_collector = AsyncAlbumCollector(
+        handle_album,
+        window=config['album_window'],
+        max_items=config['album_max_files']
+    )
+
+    @bot.message_handler(content_types=['document'])
+    async def handle_document(message):
+        """Start processing attached documents in the background, batching albums."""
+        is_supported, doc_type = check_document_type(message.document)
+        if not is_supported:
+            await bot.reply_to(message,
+                "Пожалуйста, пришлите документ в формате PDF, PNG или JPEG.")
+            return
+
+        if message.media_group_id:
+            album_collector.add(message.media_group_id, message.message_id, (message, doc_type))
+            return
+        if durable:
+            await persist_job(message, "Обрабатываю документ...", [(message.document.file_id, doc_type)])
+            return
+        await start_ingestion(message, "Обрабатываю документ...", [doc_type], process_document, message, doc_type)
+
+    async def send_trend(message, analyte):
+        """Reply with analyte history summary and chart."""
+        try:
+            with metrics.message_span('trend'):
+                result = await asyncio.to_thread(trends.analyte_trend, message.chat.id, analyte)
+        except trends.AmbiguousAnalyteError as e:
+            options = "\n".join(f"/trend {name}" for name in e.names)
+            await bot.reply_to(message, f"Уточните показатель:\n{options}")
+            return
+        except Exception as e:
+            logger.error(f"Trend error: {e}")
+            await bot.reply_to(message, f"Ошибка запроса: {e}")
+            return
+        if not result:
+            await bot.reply_to(message, f"Не найдено числовых результатов для \"{analyte}\".")
+            return
+        summary, chart = result
+        await bot.send_photo(message.chat.id, chart, caption=summary, reply_to_message_id=message.message_id)
+
+    @bot.message_handler(commands=['trend'])
+    async def trend(message):
+        """Show how an analyte changed over time: /trend гемоглобин"""
+        analyte = util.extract_arguments(message.text)
+        if not analyte:
+            await bot.reply_to(message, "Укажите показатель, например: /trend гемоглобин")
+            return
+        await send_trend(message, analyte)
+
+    @bot.message_handler(content_types=['text'])
+    async def echo_message(message):
+        with metrics.message_span('total'):
+            await answer_message(message)
+
+    async def answer_message(message):
+        """Answer text locally when possible, otherwise through the LLM."""
+        username = message.from_user.first_name
+        message_date = datetime.fromtimestamp(message.date)
+
+        with metrics.message_span('intent'):
+            analyte = parse_trend(message.text)
+            intent = None if analyte else parse_intent(message.text, message_date.date())
+
+        if analyte:
+            await send_trend(message, analyte)
+            return
+
+        if intent:
+            logger.debug(f"Parsed query without LLM: {intent}")
+            try:
+                await answer_query(message, *intent)
+            except Exception as e:
+                await bot.reply_to(message, f"Ошибка: {e}")
+            return
+
+        with metrics.message_span('llm'):
+            response = await chat_async(f"{message_date} {username}: {message.text}", chat_id=message.chat.id)
+        if "/query" in response:
+            try:
+                await handle_queries(message, response)
+            except Exception as e:
+                await bot.reply_to(message, f"Ошибка: {e}")
+        else:
+            await bot.reply_to(message, response)
+
+    if durable:
+        metrics.queue_depth.set_function(jobs.depth)
+    else:
+        metrics.queue_depth.set_function(lambda: len(ingestion_tasks))
+    if config['metrics_enabled']:
+        metrics.serve(config['webhook_host'], config['metrics_port'], config['metrics_path'])
+
+    try:
+        await bot.delete_webhook()
+        await bot.infinity_polling()
+    finally:
+        await bot.close_session()
+        await async_database.dispose_async_engine()
+        pipeline.ocr_engine.shutdown()
+        pipeline.pdf_engine.shutdown()
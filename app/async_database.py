@@ -0,0 +1,109 @@
+from datetime import date
+import logging
+from typing import Optional, Tuple, Union
+
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import Config
+import app.database as database
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+_engine = None
+_session_factory = None
+
+
+def create_async_database_url():
+    """Database URL for the asyncpg driver."""
+    return URL.create(
+        drivername='postgresql+asyncpg',
+        username=config['db_user'],
+        password=config['db_password'],
+        host=config['db_host'],
+        port=config['db_port'],
+        database=config['db_name']
+    )
+
+
+def get_async_engine():
+    """Return process-wide async engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            create_async_database_url(),
+            pool_size=config['db_pool_size'],
+            max_overflow=config['db_max_overflow'],
+            pool_pre_ping=config['db_pool_pre_ping'],
+            pool_recycle=config['db_pool_recycle'],
+            connect_args={
+                'server_settings': {'statement_timeout': str(config['db_statement_timeout'])}
+            }
+        )
+    return _engine
+
+
+def get_async_session_factory():
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(get_async_engine(), expire_on_commit=False)
+    return _session_factory
+
+
+def as_date(value):
+    """asyncpg binds dates strictly, so ISO strings must become `date` objects."""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+async def dispose_async_engine():
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _session_factory = None
+
+
+async def fetch_page(
+    telegram_id: int,
+    query_type: str,
+    document_type: Optional[str],
+    start_date: str,
+    end_date: str,
+    latest: bool = False,
+    abnormal: bool = False,
+    cursor: Optional[Tuple[date, int]] = None,
+    backward: bool = False
+) -> Tuple[Union[str, None], Optional[Tuple[date, int]], Optional[Tuple[date, int]]]:
+    """Async variant of `app.database.fetch_page`."""
+    start_date, end_date = as_date(start_date), as_date(end_date)
+    Session = get_async_session_factory()
+    async with Session() as session:
+        if latest:
+            query = database.build_period_query(
+                telegram_id, query_type, document_type, start_date, end_date, latest, abnormal
+            )
+            rows = (await session.execute(query)).all()
+            return database.format_rows(query_type, rows) or None, None, None
+
+        page_size = config['query_page_documents']
+        documents = (await session.execute(database.build_page_documents_query(
+            telegram_id, query_type, document_type, start_date, end_date,
+            abnormal, cursor, backward, limit=page_size + 1
+        ))).all()
+        has_more = len(documents) > page_size
+        documents = documents[:page_size]
+        if backward:
+            documents.reverse()
+        if not documents:
+            return None, None, None
+
+        query = database.build_period_query(
+            telegram_id, query_type, document_type, start_date, end_date,
+            abnormal=abnormal, document_ids=[document.document_id for document in documents]
+        )
+        rows = (await session.execute(query)).all()
+
+    data = database.format_rows(query_type, rows)
+    return (data or None, *database.page_cursors(documents, cursor, backward, has_more))
@@ -1,93 +1,139 @@
-from datetime import datetime
+from datetime import date, datetime
 import json 
 import logging
-import tempfile 
+import time
+import uuid
 
 import telebot
 from telebot import util
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from app.albums import AlbumCollector
+from app.cache import LRUCache
 from app.config import Config
 import app.database as database
-from app.llm import chat, wrap_in_json
-from app.ocr import extract_from_pdf, extract_from_image, LowDPIError
+import app.trends as trends
+from app.ingestion import IngestionQueue, QueueFullError
+import app.jobs as jobs
+import app.metrics as metrics
+from app.intent import parse_intent, parse_trend
+from app.llm import chat, chat_sessions
+from app.pipeline import create_pipeline
+from app.webhook import run_webhook
 
 
 config = Config.load_config()
 
-log_level_str = config['log_level']
-if log_level_str: 
-    log_level = logging.getLevelName(log_level_str) 
-else: 
-    log_level = logging.getLevelName(logging.INFO)
-
-logging.basicConfig(
-    filename='/workspaces/medtesthelper_bot/log.log',
-    filemode='a',  
-    level=logging.DEBUG,     
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'  
-)
-
 logger = logging.getLogger(__name__)
 
-logger.info("Testing logging before bot starts...")
+def check_document_type(document):
+    """Check if document type is supported."""
+    is_supported = False
+    supported_types = ['json', 'pdf', 'png', 'jpeg', 'jpg']
+
+    for doc_type in supported_types:
+        if (document.mime_type == f'application/{doc_type}' or 
+            document.file_name.endswith(f'.{doc_type}')):
+            is_supported = True
+            logger.debug(f"Found supported document type:{doc_type}")
+            return is_supported, doc_type
+    
+    logger.debug("Attached document type is not supported.")
+    return is_supported, None
+
+def encode_page(token, direction, cursor):
+    """Pack page request into callback data (at most 64 bytes)."""
+    document_date, document_id = cursor
+    return f"page:{token}:{direction}:{document_date.isoformat()}:{document_id}"
+
+def decode_page(data):
+    """Unpack callback data into (token, backward, cursor)."""
+    _, token, direction, document_date, document_id = data.split(':')
+    return token, direction == 'p', (date.fromisoformat(document_date), int(document_id))
+
+def page_markup(token, previous_cursor, next_cursor):
+    """Inline keyboard with previous/next page buttons, or None."""
+    if not (previous_cursor or next_cursor):
+        return None
+    markup = InlineKeyboardMarkup()
+    buttons = []
+    if previous_cursor:
+        buttons.append(InlineKeyboardButton(
+            "« Назад", callback_data=encode_page(token, 'p', previous_cursor)
+        ))
+    if next_cursor:
+        buttons.append(InlineKeyboardButton(
+            "Далее »", callback_data=encode_page(token, 'n', next_cursor)
+        ))
+    markup.row(*buttons)
+    return markup
 
 def run_bot():
     """Run telegram bot with provided token."""
     BOT_TOKEN = config['bot_token']
-    bot = telebot.TeleBot(BOT_TOKEN)
-    file_infos = []
-
-    def save_to_temp_file(binary_data, doc_type):
-        """Save binary data to temporary file."""
+    bot = telebot.TeleBot(BOT_TOKEN, num_threads=config['bot_threads'])
+    query_pages = metrics.track_cache('query_pages', LRUCache(config['query_page_cache_size']))
+
+    def answer_query(message, query_type, document_type, dates, latest=False, abnormal=False):
+        """Search database for the parsed query and send the first page."""
+        query = {
+            'query_type': query_type,
+            'document_type': document_type,
+            'start_date': dates[0],
+            'end_date': dates[1],
+            'latest': latest,
+            'abnormal': abnormal
+        }
+        token = uuid.uuid4().hex[:12]
+        query_pages.put(token, (message.chat.id, query))
+        send_query_page(message, token, query)
+
+    def send_query_page(message, token, query, cursor=None, backward=False):
+        """Send one page of query results with navigation buttons."""
         try:
-            logger.debug("Trying to save to temporary file...")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{doc_type}') as temp_file:
-                temp_file.write(binary_data)
-                temp_file_path = temp_file.name
-                return temp_file_path
+            with metrics.message_span('query'):
+                data, previous_cursor, next_cursor = database.fetch_page(
+                    message.chat.id, **query, cursor=cursor, backward=backward
+                )
         except Exception as e:
-            logger.error(f"Error saving to temporary file: {e}")
-            raise
-    
-    def check_document_type(document):
-        """Check if document type is supported."""
-        is_supported = False
-        supported_types = ['json', 'pdf', 'png', 'jpeg', 'jpg']
-
-        for doc_type in supported_types:
-            if (document.mime_type == f'application/{doc_type}' or 
-                document.file_name.endswith(f'.{doc_type}')):
-                is_supported = True
-                logger.debug(f"Found supported document type:{doc_type}")
-                return is_supported, doc_type
-        
-        logger.debug("Attached document type is not supported.")
-        return is_supported, None
-
-    def load_document():
-        """Load last attached document."""
-        if file_infos:
-            *_, last_added = file_infos
-            return last_added
-        else:
-            return None
+            logger.error(f"Query error: {e}")
+            raise Exception(f"Ошибка запроса: {e}")
+        if not data:
+            raise Exception("Ошибка запроса: Не найдено данных за указанный период.")
+
+        markup = page_markup(token, previous_cursor, next_cursor)
+        chunks = util.smart_split(data)
+        for number, text in enumerate(chunks, start=1):
+            bot.send_message(
+                message.chat.id,
+                text,
+                reply_markup=markup if number == len(chunks) else None
+            )
 
     def handle_queries(message, query_string):
         """Parse the query and search database."""
         try:
             query_type, document_type, dates = database.parse_query(query_string)
-            start_date, end_date = dates
-            data = database.fetch_data_by_period(
-                message.chat.id, query_type, document_type, start_date, end_date
-            )
-
-            if data:
-                return data
-            else:
-                raise Exception("Не найдено данных за указанный период.")
         except Exception as e:
             logger.error(f"Query error: {e}")
             raise Exception(f"Ошибка запроса: {e}")
+        answer_query(message, query_type, document_type, dates)
+
+    @bot.callback_query_handler(func=lambda call: call.data and call.data.startswith('page:'))
+    def page_callback(call):
+        """Fetch previous or next page of query results on demand."""
+        token, backward, cursor = decode_page(call.data)
+        stored = query_pages.get(token)
+        if not stored or stored[0] != call.message.chat.id:
+            bot.answer_callback_query(call.id, "Запрос устарел, повторите его.")
+            return
+        _, query = stored
+        bot.answer_callback_query(call.id)
+        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+        try:
+            send_query_page(call.message, token, query, cursor, backward)
+        except Exception as e:
+            bot.send_message(call.message.chat.id, f"Ошибка: {e}")
 
 
     @bot.message_handler(commands=['start'])
@@ -98,6 +144,7 @@ def run_bot():
             f"Кратко поприветствуй пользователя"
             f"{username}, представься и жди комманд."
             )
+        chat_sessions.reset(message.chat.id)
         response = chat(prompt)
         if response:
             bot.reply_to(message, response)
@@ -111,101 +158,163 @@ def run_bot():
         if photo:
             bot.reply_to(message, "Пожалуйста, прикрепите изображение как документ.")
 
+    def report_failed_job(job, error):
+        """Report failed ingestion job back to the chat."""
+        chat_id, message_id = job.args[:2]
+        bot.send_message(chat_id, f"Ошибка обработки документа: {error}", reply_to_message_id=message_id)
+
+    durable = config['ingestion_backend'] == 'postgres'
+    if durable:
+        # Jobs are processed by worker.py processes
+        ingestion_queue = None
+    else:
+        pipeline = create_pipeline(bot)
+        ingestion_queue = IngestionQueue(
+            workers=config['ingestion_workers'],
+            maxsize=config['ingestion_queue_size'],
+            on_error=report_failed_job
+        )
+        ingestion_queue.start()
+
+    def queue_depth():
+        return jobs.depth() if durable else ingestion_queue.depth()
+
+    metrics.queue_depth.set_function(queue_depth)
+
+    def submit_job(message, files, status_message):
+        """Queue (file_id, doc_type) pairs as one document and return the job id."""
+        if durable:
+            if jobs.depth() >= config['ingestion_queue_size']:
+                raise QueueFullError("Ingestion queue is full.")
+            return jobs.enqueue(message.chat.id, message.message_id, files, status_message.message_id)
+        return ingestion_queue.submit(
+            message.chat.id, pipeline.process,
+            message.chat.id, message.message_id, files, status_message.message_id, time.time()
+        ).job_id
+
+    def enqueue(message, status_message, files):
+        """Submit ingestion job and report its place in the queue."""
+        try:
+            job_id = submit_job(message, files, status_message)
+        except QueueFullError:
+            metrics.errors_total.inc(stage='queue_full')
+            bot.edit_message_text(
+                "Сервер перегружен, попробуйте прислать документ позже.",
+                status_message.chat.id,
+                status_message.message_id
+            )
+            return
+        bot.edit_message_text(
+            f"Обрабатываю документ (№{job_id}, в очереди: {queue_depth()})...",
+            status_message.chat.id,
+            status_message.message_id
+        )
+
+    def handle_album(items):
+        """Queue collected album files as one document."""
+        messages, doc_types = zip(*items)
+        status_message = bot.reply_to(messages[0], f"Обрабатываю альбом из {len(messages)} файлов...")
+        files = [(message.document.file_id, doc_type) for message, doc_type in items]
+        enqueue(messages[0], status_message, files)
+
+    album_collector = AlbumCollector(
+        handle_album,
+        window=config['album_window'],
+        max_items=config['album_max_files']
+    )
+
+    @bot.message_handler(commands=['status'])
+    def status(message):
+        """Report user's ingestion jobs and queue depth."""
+        if durable:
+            recent_jobs = jobs.jobs_for(message.chat.id)
+        else:
+            recent_jobs = ingestion_queue.jobs_for(message.chat.id)[-10:]
+        lines = [f"Документов в очереди: {queue_depth()}"]
+        for job in recent_jobs:
+            line = f"№{job.job_id}: {job.status}"
+            if job.error:
+                line += f" ({job.error})"
+            lines.append(line)
+        bot.reply_to(message, "\n".join(lines))
+
     @bot.message_handler(content_types=['document'])
     def handle_document(message):
-        """Process attached documents."""
+        """Queue attached documents for processing, batching albums."""
         document = message.document
         
         is_supported, doc_type = check_document_type(document)
 
-        if is_supported:
-            file_id = document.file_id
-            file_info = bot.get_file(file_id)
-            file_infos.append(file_info)
-
-            downloaded_file = bot.download_file(file_info.file_path)
-            file_path = save_to_temp_file(downloaded_file, doc_type)
-
-            bot.reply_to(message, f"Обрабатываю документ...")
-
-            logger.info("Extracting text from document...")
-            doc_text = None
-            if doc_type == 'pdf':
-                try:
-                    with open(file_path, 'r') as file:
-                        doc_text = extract_from_pdf(file)
-                    # bot.reply_to(message, doc_text)
-
-                except Exception as e:
-                    error_msg = f"Error extracting text from file. {e}"
-                    logger.error(error_msg)
-                    bot.reply_to(message, error_msg)
-                    
-            if doc_type in ['png', 'jpeg', 'jpg']:
-                try:
-                    extracted_tables = extract_from_image(file_path)
-                    dicts = [table.df.to_dict() for table in extracted_tables]
-                    if dicts:
-                        doc_text = str(dicts)
-                    else:
-                        doc_text = None
-                    # bot.reply_to(message, str(dicts))
-
-                except LowDPIError as e:
-                    error_msg = f"Error extracting text from file. {e}"
-                    logger.error(error_msg)
-                    bot.reply_to(message, error_msg)
-
-                except Exception as e:
-                    error_msg = f"Error extracting text from file. {e}"
-                    logger.error(error_msg)
-                    bot.reply_to(message, error_msg)
-
-            if doc_text:
-                logger.debug(f"Extracted doc text: {doc_text}")
-                logger.info("Sending doc text to LLM to parse...")
-
-                response = wrap_in_json(doc_text)
-                if response:
-                    logger.debug(f"Response json: {response}", )
-                
-                    try:
-                        logger.info("Trying to add new document to database...")
-                        add_document(message, response)
-                        bot.reply_to(message, "Документ успешно добавлен.")
-                    except Exception as e:
-                        logger.error(f"Error adding and fetching: {e}")
-                        bot.reply_to(message, e)
-                else:
-                    logger.error("Could not get response from LLM.")
-            else:
-                bot.reply_to(message, "Ошибка обработки документа.")
-            # files = [file_info.file_path for file_info in file_infos]
-            # bot.reply_to(message, ", ".join(files))
+        if is_supported and message.media_group_id:
+            album_collector.add(message.media_group_id, message.message_id, (message, doc_type))
+        elif is_supported:
+            status_message = bot.reply_to(message, "Обрабатываю документ...")
+            enqueue(message, status_message, [(document.file_id, doc_type)])
         else:
             bot.reply_to(message,
                 "Пожалуйста, пришлите документ в формате PDF, PNG или JPEG.")
-            
-    def add_document(message, json_string):
-        """Test addding to and fetching from database functionality"""
-        if json_string:
-            try:
-                result = database.add_document(message.chat.id, json_string)
-            except Exception as e:
-                bot.reply_to(f"Ошибка при добавлении документа: {e}")
+
+    def send_trend(message, analyte):
+        """Reply with analyte history summary and chart."""
+        try:
+            with metrics.message_span('trend'):
+                result = trends.analyte_trend(message.chat.id, analyte)
+        except trends.AmbiguousAnalyteError as e:
+            options = "\n".join(f"/trend {name}" for name in e.names)
+            bot.reply_to(message, f"Уточните показатель:\n{options}")
+            return
+        except Exception as e:
+            logger.error(f"Trend error: {e}")
+            bot.reply_to(message, f"Ошибка запроса: {e}")
+            return
+        if not result:
+            bot.reply_to(message, f"Не найдено числовых результатов для \"{analyte}\".")
+            return
+        summary, chart = result
+        bot.send_photo(message.chat.id, chart, caption=summary, reply_to_message_id=message.message_id)
+
+    @bot.message_handler(commands=['trend'])
+    def trend(message):
+        """Show how an analyte changed over time: /trend гемоглобин"""
+        analyte = util.extract_arguments(message.text)
+        if not analyte:
+            bot.reply_to(message, "Укажите показатель, например: /trend гемоглобин")
+            return
+        send_trend(message, analyte)
 
     @bot.message_handler(content_types=['text'])
     def echo_message(message):
+        with metrics.message_span('total'):
+            answer_message(message)
+
+    def answer_message(message):
+        """Answer text locally when possible, otherwise through the LLM."""
         username = message.from_user.first_name
         timestamp = message.date
         message_date = datetime.fromtimestamp(timestamp)
+
+        with metrics.message_span('intent'):
+            analyte = parse_trend(message.text)
+            intent = None if analyte else parse_intent(message.text, message_date.date())
+
+        if analyte:
+            send_trend(message, analyte)
+            return
+
+        if intent:
+            logger.debug(f"Parsed query without LLM: {intent}")
+            try:
+                answer_query(message, *intent)
+
+            except Exception as e:
+                bot.reply_to(message, f"Ошибка: {e}")
+            return
         
-        response = chat(f"{message_date} {username}: {message.text}")
+        with metrics.message_span('llm'):
+            response = chat(f"{message_date} {username}: {message.text}", chat_id=message.chat.id)
         if "/query" in response:
             try:
-                data = handle_queries(message, response)
-                for text in util.smart_split(data):
-                    bot.reply_to(message, text)
+                handle_queries(message, response)
 
             except Exception as e:
                 bot.reply_to(message, f"Ошибка: {e}")
@@ -213,7 +322,22 @@ def run_bot():
             bot.reply_to(message, response)
     
 
-    bot.infinity_polling()
+    if config['bot_mode'] == 'webhook':
+        # Metrics are served by the webhook server on the same port
+        run_webhook(
+            bot,
+            url=config['webhook_url'],
+            host=config['webhook_host'],
+            port=config['webhook_port'],
+            path=config['webhook_path'],
+            secret_token=config['webhook_secret'],
+            metrics_path=config['metrics_path'] if config['metrics_enabled'] else None
+        )
+    else:
+        if config['metrics_enabled']:
+            metrics.serve(config['webhook_host'], config['metrics_port'], config['metrics_path'])
+        bot.remove_webhook()
+        bot.infinity_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import json
+import logging
+import re
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 3 # conservative for mixed Cyrillic and Latin text
+
+METADATA_FIELDS = ["data_format", "institution_name", "document_type", "document_date"]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def is_table_row(line: str) -> bool:
+    return line.strip().startswith('|')
+
+
+def is_table_separator(line: str) -> bool:
+    return bool(re.fullmatch(r"\|?(\s*:?-{3,}:?\s*\|)+\s*:?-*:?\s*", line.strip()))
+
+
+def split_long_line(line: str, budget: int) -> List[str]:
+    """Split a line longer than the budget on whitespace."""
+    max_chars = budget * CHARS_PER_TOKEN
+    parts, current = [], ""
+    for word in re.split(r"(\s+)", line):
+        if current and len(current) + len(word) > max_chars:
+            parts.append(current)
+            current = ""
+        current += word
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_text(text: str, budget: int) -> List[str]:
+    """Split text into chunks of at most `budget` tokens.
+
+    Splits happen between lines, so table rows are never cut. When a chunk
+    starts inside a markdown table, the table header is repeated so every
+    chunk keeps its column names.
+    """
+    if estimate_tokens(text) <= budget:
+        return [text]
+
+    chunks, current, current_tokens = [], [], 0
+    table_header = []
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        if is_table_row(line):
+            next_line = lines[index + 1] if index + 1 < len(lines) else ""
+            if is_table_separator(next_line):
+                table_header = [line, next_line]
+        else:
+            table_header = []
+
+        for part in split_long_line(line, budget) if estimate_tokens(line) > budget else [line]:
+            part_tokens = estimate_tokens(part)
+            if current and current_tokens + part_tokens > budget:
+                chunks.append("\n".join(current))
+                repeat = table_header if is_table_row(part) and part not in table_header else []
+                current = list(repeat)
+                current_tokens = sum(estimate_tokens(header) for header in repeat)
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def is_document_json(response: str) -> bool:
+    """Check that a chunk response is complete document JSON, not truncated or prose."""
+    try:
+        document = json.loads(response)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(document, dict) and isinstance(document.get("data", []), list)
+
+
+def merge_responses(responses: List[str]) -> str:
+    """Merge JSON responses of chunks into one document JSON.
+
+    Metadata is taken from the first chunk that has it, and the data
+    arrays are concatenated with duplicate entries removed. Raises
+    ValueError if any chunk response is not document JSON, since merging
+    the rest would store a partial document.
+    """
+    merged = {field: "" for field in METADATA_FIELDS}
+    merged["data"] = []
+    seen = set()
+    for number, response in enumerate(responses, 1):
+        if not is_document_json(response):
+            raise ValueError(f"Response for chunk {number} of {len(responses)} is not valid document JSON")
+        document = json.loads(response)
+        for field in METADATA_FIELDS:
+            if not merged[field] and document.get(field):
+                merged[field] = document[field]
+        for entry in document.get("data", []):
+            key = json.dumps(entry, sort_keys=True, ensure_ascii=False).lower()
+            if key not in seen:
+                seen.add(key)
+                merged["data"].append(entry)
+    return json.dumps(merged, ensure_ascii=False)
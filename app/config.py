@@ -8,9 +8,45 @@ class Config:
     def load_config():
         # Telegram
         BOT_TOKEN = os.getenv('BOT_TOKEN')
+        BOT_MODE = os.getenv('BOT_MODE', 'polling') # polling or webhook
+        BOT_THREADS = int(os.getenv('BOT_THREADS', 8)) # handler threads
+        BOT_ASYNC = os.getenv('BOT_ASYNC', 'false').lower() == 'true' # asyncio bot, polling only
+        WEBHOOK_URL = os.getenv('WEBHOOK_URL') # public base URL, registered with Telegram if set
+        WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+        WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 80))
+        WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+        WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+        METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+        METRICS_PORT = int(os.getenv('METRICS_PORT', WEBHOOK_PORT)) # polling mode and workers; webhook mode serves metrics on WEBHOOK_PORT
+        METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
 
         # OCR
         MIN_DPI = 295
+        OCR_PROCESSES = int(os.getenv('OCR_PROCESSES', 0)) or os.cpu_count() # 0 means one per core
+        OCR_THREADS = int(os.getenv('OCR_THREADS', 1)) # Tesseract threads per document
+        OCR_TIMEOUT = int(os.getenv('OCR_TIMEOUT', 120)) # seconds
+        PDF_PROCESSES = int(os.getenv('PDF_PROCESSES', 0)) or os.cpu_count() # 0 means one per core
+        PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 30))
+        PDF_PAGE_CACHE_SIZE = int(os.getenv('PDF_PAGE_CACHE_SIZE', 512))
+        PDF_PAGE_TIMEOUT = int(os.getenv('PDF_PAGE_TIMEOUT', 60)) # seconds without a converted page
+
+        # Parsing
+        TABLE_EXTRACT_MIN_CONFIDENCE = float(os.getenv('TABLE_EXTRACT_MIN_CONFIDENCE', 0.8)) # below this the LLM is used
+
+        # Trends
+        TREND_CACHE_SIZE = int(os.getenv('TREND_CACHE_SIZE', 256))
+
+        # Ingestion
+        INGESTION_BACKEND = os.getenv('INGESTION_BACKEND', 'memory') # memory or postgres (run worker.py)
+        INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))
+        INGESTION_QUEUE_SIZE = int(os.getenv('INGESTION_QUEUE_SIZE', 100))
+        JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 600)) # seconds before a silent worker's job is retried
+        JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+        JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', 30)) # seconds, doubled after each attempt
+        JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0)) # seconds
+        ALBUM_WINDOW = float(os.getenv('ALBUM_WINDOW', 1.5)) # seconds to wait for the rest of an album
+        ALBUM_MAX_FILES = int(os.getenv('ALBUM_MAX_FILES', 10))
+        DEDUP_PAYLOAD_TTL_DAYS = int(os.getenv('DEDUP_PAYLOAD_TTL_DAYS', 30)) # 0 keeps payloads forever
    
         # Database
         DB_NAME = os.getenv('POSTGRES_DB')
@@ -18,6 +54,16 @@ class Config:
         DB_PORT = os.getenv('POSTGRES_PORT')
         DB_USER = os.getenv('POSTGRES_USER')
         DB_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+        DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+        DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+        DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+        DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800)) # seconds
+        DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 30000)) # milliseconds
+        DB_BULK_INSERT = os.getenv('DB_BULK_INSERT', 'true').lower() == 'true'
+        QUERY_BATCH_SIZE = int(os.getenv('QUERY_BATCH_SIZE', 500)) # rows fetched per round trip
+        QUERY_PAGE_DOCUMENTS = int(os.getenv('QUERY_PAGE_DOCUMENTS', 5)) # documents per reply page
+        QUERY_PAGE_CACHE_SIZE = int(os.getenv('QUERY_PAGE_CACHE_SIZE', 10000)) # queries kept for paging
+        RESOLVER_CACHE_SIZE = int(os.getenv('RESOLVER_CACHE_SIZE', 10000))
         
         TEST_DATA_FORMAT = """
     {   
@@ -55,6 +101,24 @@ class Config:
 
         # LLM
         GROQ_TOKEN = os.getenv('GROQ_TOKEN')
+        GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None # e.g. a local fake server
+        LLM_MODEL = os.getenv('LLM_MODEL', 'llama3-groq-70b-8192-tool-use-preview')
+        LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+        LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', 30))
+        LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 6000))
+        LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+        LLM_TIMEOUT = int(os.getenv('LLM_TIMEOUT', 60)) # seconds
+        LLM_CONTEXT_TOKENS = int(os.getenv('LLM_CONTEXT_TOKENS', 8192))
+        LLM_OUTPUT_TOKENS = int(os.getenv('LLM_OUTPUT_TOKENS', 2048)) # reserved for the response
+        LLM_OUTPUT_RATIO = float(os.getenv('LLM_OUTPUT_RATIO', 3.0)) # expected JSON tokens per input token
+        LLM_CHUNK_RETRIES = int(os.getenv('LLM_CHUNK_RETRIES', 1)) # retries of invalid chunk JSON
+        LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite3')
+        LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 30 * 24 * 3600)) # seconds
+        LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000))
+        CHAT_HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', 1500)) # recent turns sent with each message
+        CHAT_SESSIONS_MAX = int(os.getenv('CHAT_SESSIONS_MAX', 10000))
+        CHAT_SESSION_TTL = int(os.getenv('CHAT_SESSION_TTL', 6 * 3600)) # seconds
+        CHAT_SESSIONS_MEMORY_MB = int(os.getenv('CHAT_SESSIONS_MEMORY_MB', 64)) # hard cap for all histories
         SYSTEM_PROMPT = r"""
 Ты -- МедТест бот -- ассистент по медицинским данным, специализирующийся на помощи в организации медицинских анализов и результатов обследований. 
 Ты отвечаешь на вопросы о медицинских тестах и результатах, но избегай давать медицинские советы и обсуждать темы, не касающиеся медицинских данных. 
@@ -83,6 +147,11 @@ class Config:
 """     
 
 
+        SUMMARY_PROMPT = (
+            "Кратко перескажи разговор пользователя с МедТест ботом ниже, дополнив предыдущее краткое содержание, если оно есть. "
+            "Сохрани упомянутые анализы, исследования, даты и вопросы пользователя. Не более 100 слов, на русском языке."
+        )
+
         MAKE_JSON_PROMPT = (
             "Извлеки данные из медицинского документа ниже и заполни валидный JSON-файл по следующему образцу:" 
             "Для результатов медицинских анализов:"
@@ -152,17 +221,78 @@ class Config:
 """)
         # Optional
         LOG_LEVEL = os.getenv('LOG_LEVEL')
+        LOG_FILE = os.getenv('LOG_FILE') # stderr if unset
         
         return {
             'bot_token': BOT_TOKEN,
+            'bot_mode': BOT_MODE,
+            'bot_threads': BOT_THREADS,
+            'bot_async': BOT_ASYNC,
+            'webhook_url': WEBHOOK_URL,
+            'webhook_host': WEBHOOK_HOST,
+            'webhook_port': WEBHOOK_PORT,
+            'webhook_path': WEBHOOK_PATH,
+            'webhook_secret': WEBHOOK_SECRET,
+            'metrics_enabled': METRICS_ENABLED,
+            'metrics_port': METRICS_PORT,
+            'metrics_path': METRICS_PATH,
             'groq_token': GROQ_TOKEN,
+            'groq_base_url': GROQ_BASE_URL,
+            'llm_model': LLM_MODEL,
+            'llm_max_concurrency': LLM_MAX_CONCURRENCY,
+            'llm_requests_per_minute': LLM_REQUESTS_PER_MINUTE,
+            'llm_tokens_per_minute': LLM_TOKENS_PER_MINUTE,
+            'llm_max_retries': LLM_MAX_RETRIES,
+            'llm_timeout': LLM_TIMEOUT,
+            'llm_context_tokens': LLM_CONTEXT_TOKENS,
+            'llm_output_tokens': LLM_OUTPUT_TOKENS,
+            'llm_output_ratio': LLM_OUTPUT_RATIO,
+            'llm_chunk_retries': LLM_CHUNK_RETRIES,
+            'llm_cache_path': LLM_CACHE_PATH,
+            'llm_cache_ttl': LLM_CACHE_TTL,
+            'llm_cache_max_entries': LLM_CACHE_MAX_ENTRIES,
+            'chat_history_tokens': CHAT_HISTORY_TOKENS,
+            'chat_sessions_max': CHAT_SESSIONS_MAX,
+            'chat_session_ttl': CHAT_SESSION_TTL,
+            'chat_sessions_memory_mb': CHAT_SESSIONS_MEMORY_MB,
             'min_dpi': MIN_DPI,
+            'ocr_processes': OCR_PROCESSES,
+            'ocr_threads': OCR_THREADS,
+            'ocr_timeout': OCR_TIMEOUT,
+            'pdf_processes': PDF_PROCESSES,
+            'pdf_max_pages': PDF_MAX_PAGES,
+            'pdf_page_cache_size': PDF_PAGE_CACHE_SIZE,
+            'pdf_page_timeout': PDF_PAGE_TIMEOUT,
+            'table_extract_min_confidence': TABLE_EXTRACT_MIN_CONFIDENCE,
+            'trend_cache_size': TREND_CACHE_SIZE,
+            'ingestion_backend': INGESTION_BACKEND,
+            'ingestion_workers': INGESTION_WORKERS,
+            'ingestion_queue_size': INGESTION_QUEUE_SIZE,
+            'job_visibility_timeout': JOB_VISIBILITY_TIMEOUT,
+            'job_max_attempts': JOB_MAX_ATTEMPTS,
+            'job_retry_delay': JOB_RETRY_DELAY,
+            'job_poll_interval': JOB_POLL_INTERVAL,
+            'album_window': ALBUM_WINDOW,
+            'album_max_files': ALBUM_MAX_FILES,
+            'dedup_payload_ttl_days': DEDUP_PAYLOAD_TTL_DAYS,
             'db_name': DB_NAME,
             'db_host': DB_HOST,
             'db_port': DB_PORT,
             'db_user': DB_USER,
             'db_password': DB_PASSWORD,
+            'db_pool_size': DB_POOL_SIZE,
+            'db_max_overflow': DB_MAX_OVERFLOW,
+            'db_pool_pre_ping': DB_POOL_PRE_PING,
+            'db_pool_recycle': DB_POOL_RECYCLE,
+            'db_statement_timeout': DB_STATEMENT_TIMEOUT,
+            'db_bulk_insert': DB_BULK_INSERT,
+            'query_batch_size': QUERY_BATCH_SIZE,
+            'query_page_documents': QUERY_PAGE_DOCUMENTS,
+            'query_page_cache_size': QUERY_PAGE_CACHE_SIZE,
+            'resolver_cache_size': RESOLVER_CACHE_SIZE,
             'log_level': LOG_LEVEL,
+            'log_file': LOG_FILE,
             'system_prompt': SYSTEM_PROMPT,
+            'summary_prompt': SUMMARY_PROMPT,
             'make_json_prompt': MAKE_JSON_PROMPT
         }
\ No newline at end of file
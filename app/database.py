@@ -1,21 +1,24 @@
 from datetime import date
 import logging
 import re
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Callable, Optional, Tuple
 
 from sqlalchemy import create_engine
 from sqlalchemy import desc
+from sqlalchemy import exists
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy import update
 from sqlalchemy.engine import URL
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.orm import joinedload
-from typing import Union
-
-from sqlalchemy.orm import selectinload
 
 from app.config import Config
+import app.resolution as resolution
 from app.document_parse import (
     MedTestDataEntry, MedStudyDataEntry, Document
 )
+from app.values import parse_test_values
 from app.schema import (
     User, MedicalInstitution, 
     MedicalDocument, TestData, StudyData, create_tables
@@ -23,19 +26,6 @@ from app.schema import (
 
 config = Config.load_config()
 
-log_level_str = config['log_level']
-if log_level_str: 
-    log_level = logging.getLevelName(log_level_str) 
-else: 
-    log_level = logging.getLevelName(logging.INFO)
-
-logging.basicConfig(
-    filename='log.log',
-    filemode='a',  
-    level=logging.DEBUG,     
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'  
-)
-
 logger = logging.getLogger(__name__)
 
 def create_database_url():
@@ -51,20 +41,93 @@ def create_database_url():
     return url
 
 def create_database_engine():
-    """Create engine for accessing database"""
+    """Create pooled engine for accessing database."""
     url = create_database_url()
-    engine = create_engine(url)
+    engine = create_engine(
+        url,
+        pool_size=config['db_pool_size'],
+        max_overflow=config['db_max_overflow'],
+        pool_pre_ping=config['db_pool_pre_ping'],
+        pool_recycle=config['db_pool_recycle'],
+        connect_args={
+            'options': f"-c statement_timeout={config['db_statement_timeout']}"
+        }
+    )
     return engine
 
+_engine = None
+_session_factory = None
+
+def get_engine():
+    """Return process-wide database engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_database_engine()
+        logger.info("Created database engine with pool size %s", config['db_pool_size'])
+    return _engine
+
+def get_session_factory():
+    """Return process-wide session factory bound to the shared engine."""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory
+
+def dispose_engine():
+    """Close all pooled connections, e.g. after fork or on shutdown."""
+    global _engine, _session_factory
+    if _engine is not None:
+        _engine.dispose()
+    _engine = None
+    _session_factory = None
+
 def create_database_tables():
     """Create database tables according to schema."""
-    engine = create_database_engine()
+    engine = get_engine()
     try:
-        create_tables(engine)    
+        added_columns = create_tables(engine)    
         logger.info("Successfully created tables!")
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
         raise
+    if added_columns:
+        logger.info(f"Added columns: {', '.join(added_columns)}")
+    backfill_test_values()
+
+def backfill_test_values(batch_size=1000):
+    """Parse numeric values and ranges of test data rows that have none yet.
+
+    Runs on every start, so a backfill interrupted part way is finished by
+    the next start. Rows whose values are not numeric stay unparsed and
+    are rechecked each time.
+    """
+    Session = get_session_factory()
+    last_id = 0
+    updated = 0
+    with Session() as session:
+        while True:
+            rows = session.execute(
+                select(TestData.data_id, TestData.value, TestData.range)
+                .where(
+                    TestData.data_id > last_id,
+                    TestData.value.isnot(None),
+                    TestData.value_numeric.is_(None),
+                    TestData.is_abnormal.is_(None)
+                )
+                .order_by(TestData.data_id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            session.execute(update(TestData), [
+                {'data_id': row.data_id, **parse_test_values(row.value, row.range)}
+                for row in rows
+            ])
+            session.commit()
+            last_id = rows[-1].data_id
+            updated += len(rows)
+    if updated:
+        logger.info(f"Backfilled numeric values of {updated} test data rows")
 
 def add_medical_document(
     session: Session, 
@@ -73,25 +136,19 @@ def add_medical_document(
     document_type: str,
     document_date: date, 
     data_format: str,
-    data_entries: List[Union[MedTestDataEntry, MedStudyDataEntry]]
+    data_entries: List[Union[MedTestDataEntry, MedStudyDataEntry]],
+    record: Optional[Callable[[int], Any]] = None
 ):
     """Add user's medical document to the database."""
     try:
         # User and Institution retrieval
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            user = User(telegram_id=telegram_id)
-            session.add(user)
-
-        institution = session.query(MedicalInstitution).filter_by(name=institution_name).first()
-        if not institution:
-            institution = MedicalInstitution(name=institution_name)
-            session.add(institution)
+        user_id = resolution.resolve_user_id(session, telegram_id)
+        institution_id = resolution.resolve_institution_id(session, institution_name)
 
         # Document creation
         document = MedicalDocument(
-            user=user,
-            institution=institution,
+            user_id=user_id,
+            institution_id=institution_id,
             document_type=document_type,
             document_date=document_date
         )
@@ -108,7 +165,8 @@ def add_medical_document(
                     value=entry.value,
                     unit=entry.unit,
                     range=entry.ref_range,
-                    commentary=entry.commentary
+                    commentary=entry.commentary,
+                    **parse_test_values(entry.value, entry.ref_range)
                 )
                 session.add(test_data)
         elif data_format == 'study':
@@ -124,33 +182,133 @@ def add_medical_document(
                 )
                 session.add(study_data)
 
+        if record:
+            session.flush()
+            session.execute(record(document.document_id))
         session.commit()
         logger.info("Successfully added medical document for user %s", telegram_id)
+        return document.document_id
     except Exception as e:
         logger.error("Error adding medical document: %s", e)
         session.rollback()
+        resolution.forget(telegram_id, institution_name)
         raise
 
 
-def add_document(telegram_id, document_json):
-    engine = create_database_engine()
-    Session = sessionmaker(bind=engine)
+def build_data_rows(
+    data_format: str,
+    data_entries: List[Union[MedTestDataEntry, MedStudyDataEntry]]
+) -> List[Dict[str, Any]]:
+    """Validate data entries and convert them to insertable rows."""
+    rows = []
+    if data_format == 'test':
+        for entry in data_entries:
+            if not entry.name or not entry.value:
+                raise ValueError("Invalid test entry data.")
+            rows.append({
+                'name': entry.name,
+                'value': entry.value,
+                'unit': entry.unit,
+                'range': entry.ref_range,
+                'commentary': entry.commentary,
+                **parse_test_values(entry.value, entry.ref_range)
+            })
+    elif data_format == 'study':
+        for entry in data_entries:
+            if not entry.device or not entry.result:
+                raise ValueError("Invalid study entry data.")
+            rows.append({
+                'device': entry.device,
+                'result': entry.result,
+                'report': entry.report,
+                'recommendation': entry.recommendation
+            })
+    return rows
+
+
+def add_medical_document_bulk(
+    session: Session, 
+    telegram_id: int, 
+    institution_name: str, 
+    document_type: str,
+    document_date: date, 
+    data_format: str,
+    data_entries: List[Union[MedTestDataEntry, MedStudyDataEntry]],
+    record: Optional[Callable[[int], Any]] = None
+) -> int:
+    """Add user's medical document using bulk Core inserts.
+
+    The document row is written with INSERT ... RETURNING and all data
+    entries with a single batched executemany, bypassing the ORM unit of work.
+    Returns the new document id.
+    """
+    try:
+        # Validate before touching the database
+        rows = build_data_rows(data_format, data_entries)
+
+        user_id = resolution.resolve_user_id(session, telegram_id)
+        institution_id = resolution.resolve_institution_id(session, institution_name)
+
+        document_id = session.execute(
+            insert(MedicalDocument)
+            .values(
+                user_id=user_id,
+                institution_id=institution_id,
+                document_type=document_type,
+                document_date=document_date
+            )
+            .returning(MedicalDocument.document_id)
+        ).scalar_one()
+
+        if rows:
+            model = TestData if data_format == 'test' else StudyData
+            for row in rows:
+                row['document_id'] = document_id
+            session.execute(insert(model), rows)
+
+        if record:
+            session.execute(record(document_id))
+        session.commit()
+        logger.info(
+            "Successfully bulk added medical document %s with %s entries for user %s",
+            document_id, len(rows), telegram_id
+        )
+        return document_id
+    except Exception as e:
+        logger.error("Error adding medical document: %s", e)
+        session.rollback()
+        resolution.forget(telegram_id, institution_name)
+        raise
+
+
+def add_document(telegram_id, document_json, record=None):
+    """Parse document JSON and store it, returning the new document id.
+
+    `record(document_id)` may return a statement to execute in the same
+    transaction, such as the upload record of the document.
+    """
+    Session = get_session_factory()
     document = Document.from_json(document_json)
     with Session() as session:
         session.expire_all()
+        if config['db_bulk_insert']:
+            add_func = add_medical_document_bulk
+        else:
+            add_func = add_medical_document
         try:
-            add_medical_document(
+            return add_func(
                 session,
                 telegram_id=telegram_id,
                 institution_name=document.institution_name,
                 document_type=document.document_type,
                 document_date=document.document_date,
                 data_format=document.data_format,
-                data_entries=document.data
+                data_entries=document.data,
+                record=record
             )
         except Exception as e:
-            logger.error(f"{telegram_id}: Error adding document.")
-            return "Error processing request."
+            logger.error(f"{telegram_id}: Error adding document: {e}")
+            raise
 
 def parse_query(query_string):
     """Parse LLM query command."""
@@ -173,83 +331,205 @@ def parse_query(query_string):
         raise ValueError("Invalid query format")
 
 
-def fetch_data_by_period(telegram_id: int, query_type: str, document_type: str, start_date: str, end_date: str) -> Union[str, None]:
+def period_filters(telegram_id: int, query_type: str, document_type: Optional[str], start_date: str, end_date: str, abnormal: bool = False):
+    """Return data model, document filters and data row filters shared by period queries."""
+    data_model = TestData if query_type == 'test' else StudyData
+    document_filters = [
+        User.telegram_id == telegram_id,
+        MedicalDocument.document_date.between(start_date, end_date)
+    ]
+    if document_type is not None:
+        document_filters.append(MedicalDocument.document_type == document_type)
+    data_filters = []
+    if abnormal and query_type == 'test':
+        data_filters.append(TestData.is_abnormal.is_(True))
+    return data_model, document_filters, data_filters
+
+
+def build_period_query(telegram_id: int, query_type: str, document_type: Optional[str], start_date: str, end_date: str, latest: bool = False, abnormal: bool = False, document_ids: Optional[List[int]] = None):
+    """Build single joined query for user's data in the period.
+
+    Selects only the columns the reply formatter needs, ordered by date and document.
+    With `latest`, only the most recent matching document is returned.
+    With `abnormal`, only out-of-range test results are returned.
+    With `document_ids`, only rows of these documents are returned.
+    A `document_type` of None matches documents of any type.
+    """
+    if query_type == 'test':
+        data_columns = (
+            TestData.name, TestData.value, TestData.unit, TestData.range,
+            TestData.commentary, TestData.is_abnormal
+        )
+    else:  # query_type == 'study'
+        data_columns = (StudyData.device, StudyData.result, StudyData.report, StudyData.recommendation)
+
+    data_model, document_filters, data_filters = period_filters(
+        telegram_id, query_type, document_type, start_date, end_date, abnormal
+    )
+    filters = document_filters + data_filters
+    if latest:
+        latest_document = (
+            select(MedicalDocument.document_id)
+            .join(User, MedicalDocument.user_id == User.user_id)
+            .join(data_model, data_model.document_id == MedicalDocument.document_id)
+            .where(*filters)
+            .order_by(desc(MedicalDocument.document_date), desc(MedicalDocument.document_id))
+            .limit(1)
+            .scalar_subquery()
+        )
+        filters.append(MedicalDocument.document_id == latest_document)
+    if document_ids is not None:
+        filters.append(MedicalDocument.document_id.in_(document_ids))
+
+    return (
+        select(
+            MedicalDocument.document_id,
+            MedicalDocument.document_date,
+            MedicalInstitution.name.label('institution_name'),
+            *data_columns
+        )
+        .select_from(MedicalDocument)
+        .join(User, MedicalDocument.user_id == User.user_id)
+        .join(data_model, data_model.document_id == MedicalDocument.document_id)
+        .outerjoin(MedicalInstitution, MedicalDocument.institution_id == MedicalInstitution.institution_id)
+        .where(*filters)
+        .order_by(MedicalDocument.document_date, MedicalDocument.document_id, data_model.data_id)
+    )
+
+
+def build_page_documents_query(telegram_id: int, query_type: str, document_type: Optional[str], start_date: str, end_date: str, abnormal: bool = False, cursor: Optional[Tuple[date, int]] = None, backward: bool = False, limit: int = 5):
+    """Build keyset query for one page of matching documents.
+
+    Documents are ordered by (document_date, document_id). Moving forward
+    returns documents after `cursor`, moving backward the ones before it,
+    nearest first.
+    """
+    data_model, filters, data_filters = period_filters(
+        telegram_id, query_type, document_type, start_date, end_date, abnormal
+    )
+    key = tuple_(MedicalDocument.document_date, MedicalDocument.document_id)
+    if cursor is not None:
+        filters.append(key < tuple_(*cursor) if backward else key > tuple_(*cursor))
+    if backward:
+        order = (desc(MedicalDocument.document_date), desc(MedicalDocument.document_id))
+    else:
+        order = (MedicalDocument.document_date, MedicalDocument.document_id)
+
+    return (
+        select(MedicalDocument.document_id, MedicalDocument.document_date)
+        .join(User, MedicalDocument.user_id == User.user_id)
+        .where(
+            *filters,
+            exists().where(data_model.document_id == MedicalDocument.document_id, *data_filters)
+        )
+        .order_by(*order)
+        .limit(limit)
+    )
+
+
+def format_test_row(row) -> str:
+    mark = " ⚠️" if row.is_abnormal else ""
+    return (
+        f"{row.name}: {row.value} {row.unit} (реф. знач.: {row.range}){mark}\n"
+        f"комментарий: {row.commentary}\n"
+    )
+
+
+def format_study_row(row) -> str:
+    return (
+        f"Аппарат: {row.device}\n\n"
+        f"Заключение:\n{row.result}\n\n"
+        f"Протокол:\n{row.report}\n\n"
+        f"Рекомендация:\n{row.recommendation}\n\n"
+    )
+
+
+def format_rows(query_type: str, rows) -> str:
+    """Group rows by document and format them as reply text."""
+    format_row = format_test_row if query_type == 'test' else format_study_row
+    document_data = {}
+    for row in rows:
+        if row.document_id not in document_data:
+            document_data[row.document_id] = {
+                'date': row.document_date,
+                'institution': row.institution_name or 'N/A',
+                'entries': []
+            }
+        document_data[row.document_id]['entries'].append(format_row(row))
+
+    fetched_data = []
+    for data in document_data.values():
+        fetched_data.append(f"Дата: {data['date']}\nМесто проведения: {data['institution']}")
+        fetched_data.append("\n".join(data['entries']))
+        fetched_data.append("")  # Add a blank line for separation
+
+    return "\n".join(fetched_data).strip()  # Remove any trailing newline
+
+
+def fetch_data_by_period(telegram_id: int, query_type: str, document_type: Optional[str], start_date: str, end_date: str, latest: bool = False, abnormal: bool = False) -> Union[str, None]:
     """Fetch test or study data for the user based on the period and query type."""
-    engine = create_database_engine()
-    Session = sessionmaker(bind=engine)
+    Session = get_session_factory()
+    query = build_period_query(telegram_id, query_type, document_type, start_date, end_date, latest, abnormal)
     with Session() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return "User not found."
-        
-        if query_type == 'test':
-            documents = session.query(TestData).options(selectinload(TestData.document).selectinload(MedicalDocument.institution)).filter(
-                TestData.document.has(MedicalDocument.user_id == user.user_id),
-                TestData.document.has(MedicalDocument.document_type == document_type),
-                TestData.document.has(MedicalDocument.document_date.between(start_date, end_date))
-            ).all()
-        else:  # query_type == 'study'
-            documents = session.query(StudyData).options(selectinload(StudyData.document).selectinload(MedicalDocument.institution)).filter(
-                StudyData.document.has(MedicalDocument.user_id == user.user_id),
-                StudyData.document.has(MedicalDocument.document_type == document_type),
-                StudyData.document.has(MedicalDocument.document_date.between(start_date, end_date))
-            ).all()
-        
-        if documents:
-            fetched_data = []
-            document_data = {}
-
-            if query_type == 'test':
-                for doc in documents:
-                    document = doc.document  # Access the associated MedicalDocument
-                    institution = document.institution if document else None
-                    
-                    if document.document_id not in document_data:
-                        document_data[document.document_id] = {
-                            'date': document.document_date,
-                            'institution': institution.name if institution else 'N/A',
-                            'tests': []
-                        }
-
-                    document_data[document.document_id]['tests'].append(
-                        f"{doc.name}: {doc.value} {doc.unit} (реф. знач.: {doc.range})\n"
-                        f"комментарий: {doc.commentary}\n"
-                    )
-
-            elif query_type == 'study':
-                for doc in documents:
-                    document = doc.document  # Access the associated MedicalDocument
-                    institution = document.institution if document else None
-                    
-                    # If the document is not already processed, add the header
-                    if document.document_id not in document_data:
-                        document_data[document.document_id] = {
-                            'date': document.document_date,
-                            'institution': institution.name if institution else 'N/A',
-                            'studies': []
-                        }
-
-                    # Add study data to the corresponding document
-                    document_data[document.document_id]['studies'].append(
-                        f"Аппарат: {doc.device}\n\n"
-                        f"Заключение:\n{doc.result}\n\n"
-                        f"Протокол:\n{doc.report}\n\n"
-                        f"Рекомендация:\n{doc.recommendation}\n\n"
-                    )
-
-            # Format the final output
-            for doc_id, data in document_data.items():
-                fetched_data.append(f"Дата: {data['date']}\nМесто проведения: {data['institution']}")
-                if query_type == 'test':
-                    fetched_data.append("\n".join(data['tests']))
-                else:
-                    fetched_data.append("\n".join(data['studies']))
-                fetched_data.append("")  # Add a blank line for separation
-
-            return "\n".join(fetched_data).strip()  # Remove any trailing newline
-        else:
-            return None
+        rows = session.execute(query.execution_options(yield_per=config['query_batch_size']))
+        data = format_rows(query_type, rows)
+
+    return data or None
+
+
+def fetch_page(
+    telegram_id: int,
+    query_type: str,
+    document_type: Optional[str],
+    start_date: str,
+    end_date: str,
+    latest: bool = False,
+    abnormal: bool = False,
+    cursor: Optional[Tuple[date, int]] = None,
+    backward: bool = False
+) -> Tuple[Union[str, None], Optional[Tuple[date, int]], Optional[Tuple[date, int]]]:
+    """Fetch one page of documents for the user, paginated by (date, document id).
+
+    Returns the page text and the cursors of the previous and next pages
+    (None when there is no such page). Rows are streamed from the server
+    in batches instead of being loaded at once.
+    """
+    if latest:
+        return fetch_data_by_period(
+            telegram_id, query_type, document_type, start_date, end_date, latest, abnormal
+        ), None, None
+
+    page_size = config['query_page_documents']
+    Session = get_session_factory()
+    with Session() as session:
+        documents = session.execute(build_page_documents_query(
+            telegram_id, query_type, document_type, start_date, end_date,
+            abnormal, cursor, backward, limit=page_size + 1
+        )).all()
+        has_more = len(documents) > page_size
+        documents = documents[:page_size]
+        if backward:
+            documents.reverse()
+        if not documents:
+            return None, None, None
+
+        query = build_period_query(
+            telegram_id, query_type, document_type, start_date, end_date,
+            abnormal=abnormal, document_ids=[document.document_id for document in documents]
+        )
+        rows = session.execute(query.execution_options(yield_per=config['query_batch_size']))
+        data = format_rows(query_type, rows)
+
+    return (data or None, *page_cursors(documents, cursor, backward, has_more))
+
 
+def page_cursors(documents, cursor, backward: bool, has_more: bool):
+    """Return (previous, next) cursors of a non-empty page of documents."""
+    first = (documents[0].document_date, documents[0].document_id)
+    last = (documents[-1].document_date, documents[-1].document_id)
+    if backward:
+        return (first if has_more else None), last
+    return (first if cursor is not None else None), (last if has_more else None)
 
 if __name__ == "__main__":
     print(fetch_data_by_period("82085270", "test", "анализ крови", "2024-01-01", "2024-12-31"))
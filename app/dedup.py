@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+import hashlib
+import logging
+
+from sqlalchemy import case, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import Config
+import app.database as database
+from app.schema import UploadedDocument
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+
+def hash_content(data: bytes) -> str:
+    """Return SHA-256 hex digest of uploaded file contents."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def lookup(telegram_id: int, content_hash: str):
+    """Find a previous upload of the same content.
+
+    Prefers the user's own upload (which already has a stored document),
+    then falls back to any upload with cached extraction results.
+    Returns an `UploadedDocument` row or None.
+    """
+    Session = database.get_session_factory()
+    with Session() as session:
+        upload = session.execute(
+            select(UploadedDocument)
+            .where(
+                UploadedDocument.content_hash == content_hash,
+                (UploadedDocument.telegram_id == telegram_id)
+                | UploadedDocument.parsed_json.isnot(None)
+            )
+            .order_by(case((UploadedDocument.telegram_id == telegram_id, 0), else_=1))
+            .limit(1)
+        ).scalar_one_or_none()
+        if upload:
+            upload.accessed_at = datetime.utcnow()
+            session.commit()
+            session.refresh(upload)
+            session.expunge(upload)
+            logger.debug("Dedup hit for %s", content_hash)
+        return upload
+
+
+def upsert_upload(telegram_id: int, content_hash: str, extracted_text: str, parsed_json: str, document_id: int):
+    """Statement recording upload of content and its extraction results for the user.
+
+    Executed in the transaction that inserts the document, so a retried
+    job never finds the document stored without its upload record.
+    """
+    now = datetime.utcnow()
+    values = {
+        'extracted_text': extracted_text,
+        'parsed_json': parsed_json,
+        'document_id': document_id,
+        'accessed_at': now
+    }
+    return (
+        insert(UploadedDocument)
+        .values(telegram_id=telegram_id, content_hash=content_hash, created_at=now, **values)
+        .on_conflict_do_update(
+            index_elements=[UploadedDocument.telegram_id, UploadedDocument.content_hash],
+            set_=values
+        )
+    )
+
+
+def evict_payloads():
+    """Drop text and JSON payloads not accessed within the configured TTL.
+
+    The hash to document id mapping is kept, so re-uploads are still
+    recognized after their payloads are evicted.
+    """
+    ttl_days = config['dedup_payload_ttl_days']
+    if not ttl_days:
+        return
+    Session = database.get_session_factory()
+    with Session() as session:
+        result = session.execute(
+            update(UploadedDocument)
+            .where(
+                UploadedDocument.accessed_at < datetime.utcnow() - timedelta(days=ttl_days),
+                UploadedDocument.parsed_json.isnot(None)
+            )
+            .values(extracted_text=None, parsed_json=None)
+        )
+        session.commit()
+        if result.rowcount:
+            logger.info("Evicted %s cached upload payloads", result.rowcount)
@@ -75,7 +75,38 @@ class Document:
             return cls(data_format, institution_name, document_type, document_date, data_entries)
         else:
             return None
-        
+
+
+    def to_json(self):
+        """Serialize to the JSON format produced by the LLM."""
+        if self.data_format == "test":
+            data = [
+                {
+                    "name": entry.name,
+                    "value": entry.value,
+                    "unit": entry.unit,
+                    "range": entry.ref_range,
+                    "commentary": entry.commentary
+                }
+                for entry in self.data
+            ]
+        else:
+            data = [
+                {
+                    "device": entry.device,
+                    "result": entry.result,
+                    "report": entry.report,
+                    "recommendation": entry.recommendation
+                }
+                for entry in self.data
+            ]
+        return json.dumps({
+            "data_format": self.data_format,
+            "institution_name": self.institution_name,
+            "document_type": self.document_type,
+            "document_date": str(self.document_date),
+            "data": data
+        }, ensure_ascii=False)
 
     def __repr__(self):
         return (f"Document(institution_name={self.institution_name}, document_type={self.document_type}, "
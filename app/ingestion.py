@@ -0,0 +1,113 @@
+from datetime import datetime
+import itertools
+import logging
+import queue
+import threading
+
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue cannot accept more jobs."""
+    pass
+
+
+class Job:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, chat_id, func, args):
+        self.job_id = job_id
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.status = Job.QUEUED
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    def __repr__(self):
+        return f"Job(job_id={self.job_id}, chat_id={self.chat_id}, status={self.status})"
+
+
+class IngestionQueue:
+    """Job queue serviced by a fixed pool of worker threads.
+
+    `on_error(job, exception)` is called from the worker when a job raises.
+    Finished jobs are kept in a bounded history for status reporting.
+    """
+
+    def __init__(self, workers=2, maxsize=100, history_size=1000, on_error=None):
+        self.workers = workers
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs = LRUCache(history_size)
+        self._ids = itertools.count(1)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"ingestion-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %s ingestion workers", self.workers)
+
+    def stop(self):
+        """Let workers finish queued jobs and exit."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, chat_id, func, *args):
+        """Enqueue `func(*args)` and return its job without waiting."""
+        job = Job(next(self._ids), chat_id, func, args)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError("Ingestion queue is full.")
+        self._jobs.put(job.job_id, job)
+        logger.debug("Queued %s, queue depth %s", job, self.depth())
+        return job
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs_for(self, chat_id):
+        """Return known jobs of the chat, oldest first."""
+        return [job for job in self._jobs.values() if job.chat_id == chat_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            job.status = Job.RUNNING
+            job.started_at = datetime.now()
+            try:
+                job.func(*job.args)
+                job.status = Job.DONE
+            except Exception as e:
+                job.status = Job.FAILED
+                job.error = str(e)
+                logger.error("Ingestion %s failed: %s", job, e)
+                if self.on_error:
+                    try:
+                        self.on_error(job, e)
+                    except Exception as callback_error:
+                        logger.error("Error reporting failed %s: %s", job, callback_error)
+            finally:
+                job.finished_at = datetime.now()
+                self._queue.task_done()
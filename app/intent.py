@@ -0,0 +1,155 @@
+import calendar
+from datetime import date
+import re
+from typing import Optional, Tuple
+
+# Categories from SYSTEM_PROMPT with word stems users commonly write.
+# Order matters: the first matching category wins.
+TEST_CATEGORIES = [
+    ("анализ крови", r"кров|\bоак\b|гемоглобин|лейкоцит|эритроцит|тромбоцит"),
+    ("анализ мочи", r"\bмоч[аиеуй]\b|\bоам\b"),
+    ("копрограмма", r"копрограм|\bкал\b|\bкала\b|\bкале\b"),
+    ("бактериология", r"бактери|\bпосев|микрофлор"),
+    ("аллергены", r"аллерг"),
+    ("онкомаркеры", r"онкомаркер"),
+]
+STUDY_CATEGORIES = [
+    ("узи", r"\bузи\b|ультразвук"),
+    ("эхокардиография", r"\bэкг\b|\bэхо\s?кг\b|эхокардиограф|кардиограм"),
+    ("томография", r"томограф|\bмрт\b|\bкт\b"),
+    ("рентгенография", r"рентген|флюорограф"),
+]
+
+MONTHS = [
+    r"январ", r"феврал", r"март", r"апрел", r"\bма[йяе]\b", r"июн",
+    r"июл", r"август", r"сентябр", r"октябр", r"ноябр", r"декабр",
+]
+
+REQUEST_WORDS = (
+    r"\b(?:результат\w*|покажи\w*|пришли\w*|скинь\w*|выведи\w*|найди\w*|дай|дайте|"
+    r"сдавал\w*|делал\w*|проходил\w*|был|была|были|есть|какие|каких)\b"
+)
+# Questions asking for advice rather than stored data go to the LLM
+QUESTION_WORDS = r"\bкак\b|можно\s+ли|\bчто\b|\bчем\b|почему|зачем|нужно|надо|стоит\s+ли|подготов|назначил|назначен"
+LATEST_WORDS = r"последн|свеж|недавн"
+ABNORMAL_WORDS = r"отклонен|вне\s+норм|не\s+в\s+норм|выше\s+норм|ниже\s+норм|плох\w*\s+(анализ|результат|показател)|повышен|понижен"
+EARLIEST_DATE = date(1900, 1, 1)
+
+TREND_PATTERN = r"(?:динамик\w*|график\w*|тренд\w*|как\s+(?:из)?менял\w*)((?:\s+[\w-]+){1,4})"
+TREND_FILLER_WORDS = {
+    "по", "у", "меня", "мой", "моя", "мое", "мои", "моего", "моей", "моих",
+    "уровень", "уровня", "показатель", "показателя", "значение", "значения", "в", "крови",
+}
+
+
+def find_category(text: str) -> Optional[Tuple[str, str]]:
+    """Return (query_type, document_type) mentioned in text."""
+    for query_type, categories in (("study", STUDY_CATEGORIES), ("test", TEST_CATEGORIES)):
+        for document_type, pattern in categories:
+            if re.search(pattern, text):
+                return query_type, document_type
+    return None
+
+
+def month_range(year: int, month: int) -> Tuple[date, date]:
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, 1), date(year, month, last_day)
+
+
+def parse_date(value: str) -> Optional[date]:
+    for pattern in (r"(\d{4})-(\d{2})-(\d{2})", r"(\d{2})\.(\d{2})\.(\d{4})"):
+        match = re.fullmatch(pattern, value)
+        if match:
+            parts = [int(part) for part in match.groups()]
+            year, month, day = parts if pattern.startswith(r"(\d{4})") else parts[::-1]
+            try:
+                return date(year, month, day)
+            except ValueError:
+                return None
+    return None
+
+
+def find_period(text: str, today: date) -> Optional[Tuple[date, date]]:
+    """Return (start, end) dates of the period mentioned in text."""
+    dates = re.findall(r"\d{4}-\d{2}-\d{2}|\d{2}\.\d{2}\.\d{4}", text)
+    if len(dates) >= 2:
+        start, end = parse_date(dates[0]), parse_date(dates[1])
+        if start and end:
+            return start, end
+
+    if re.search(r"(в|за)\s+эт(ом|от)\s+год", text):
+        return date(today.year, 1, 1), date(today.year, 12, 31)
+    if re.search(r"(в|за)\s+прошл(ом|ый)\s+год", text):
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+    if re.search(r"(в|за)\s+эт(ом|от)\s+месяц", text):
+        return month_range(today.year, today.month)
+    if re.search(r"(в|за)\s+прошл(ом|ый)\s+месяц", text):
+        year, month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+        return month_range(year, month)
+
+    year_match = re.search(r"\b(19\d{2}|20\d{2})\b", text)
+    year = int(year_match.group(1)) if year_match else None
+    for number, pattern in enumerate(MONTHS, start=1):
+        if re.search(pattern, text):
+            return month_range(year or today.year, number)
+    if year:
+        return date(year, 1, 1), date(year, 12, 31)
+    return None
+
+
+def parse_trend(text: str) -> Optional[str]:
+    """Return analyte of a trend question like "как менялся гемоглобин"."""
+    text = text.lower().replace("ё", "е")
+    match = re.search(TREND_PATTERN, text)
+    if not match:
+        return None
+    for word in match.group(1).split():
+        if word not in TREND_FILLER_WORDS:
+            return word
+    return None
+
+
+def parse_intent(text: str, today: Optional[date] = None):
+    """Parse common data queries without the LLM.
+
+    Returns (query_type, document_type, (start_date, end_date), latest, abnormal)
+    with ISO date strings, or None if the text is not a recognized query.
+    Every query needs a request word such as "покажи" or "сдавал", and
+    questions such as "как" or "можно ли" are left to the LLM.
+    A document_type of None means test results of any type.
+    """
+    today = today or date.today()
+    text = text.lower().replace("ё", "е")
+    if not re.search(REQUEST_WORDS, text) or re.search(QUESTION_WORDS, text):
+        return None
+
+    abnormal = bool(re.search(ABNORMAL_WORDS, text))
+    category = find_category(text)
+    if category:
+        query_type, document_type = category
+    elif abnormal:
+        query_type, document_type = "test", None
+    else:
+        return None
+
+    latest = bool(re.search(LATEST_WORDS, text))
+    period = find_period(text, today)
+    start_date, end_date = period or (EARLIEST_DATE, today)
+
+    return query_type, document_type, (start_date.isoformat(), end_date.isoformat()), latest, abnormal
+
+
+if __name__ == "__main__":
+    for text in [
+        "Скинь результаты анализа крови за август 2022.",
+        "Я сдавал кал в этом году?",
+        "результаты экг за июль 2004",
+        "Покажи самый последний анализ крови",
+        "Что такое гемоглобин?",
+        "Покажи все результаты с отклонениями в этом году",
+        "Мне назначили МРТ на август, как подготовиться?",
+        "Я забыл сдать анализ крови",
+        "передай привет, кровь",
+    ]:
+        print(text, parse_intent(text, date(2024, 10, 1)))
+    print(parse_trend("Как менялся мой уровень гемоглобина?"))
@@ -0,0 +1,304 @@
+from datetime import timedelta
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+import requests
+from sqlalchemy import and_, exc, func, or_, select, update
+from telebot.apihelper import ApiTelegramException
+
+from app.config import Config
+import app.database as database
+from app.ingestion import Job
+from app.llm_gateway import LLMGateway
+from app.schema import IngestionJob
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+# Database clock, so leases mean the same thing on every worker host
+db_now = func.timezone('utc', func.now())
+
+
+def enqueue(chat_id, message_id, files, status_message_id=None):
+    """Persist ingestion job for `files` ([(file_id, doc_type), ...]) and return its id."""
+    Session = database.get_session_factory()
+    with Session() as session:
+        job = IngestionJob(
+            chat_id=chat_id,
+            message_id=message_id,
+            status_message_id=status_message_id,
+            files=json.dumps(files),
+            status=Job.QUEUED
+        )
+        session.add(job)
+        session.commit()
+        logger.debug("Persisted ingestion job %s for chat %s", job.job_id, chat_id)
+        return job.job_id
+
+
+def depth():
+    """Number of jobs waiting to be claimed."""
+    Session = database.get_session_factory()
+    with Session() as session:
+        return session.execute(
+            select(func.count()).select_from(IngestionJob).where(IngestionJob.status == Job.QUEUED)
+        ).scalar_one()
+
+
+def jobs_for(chat_id, limit=10):
+    """Return the chat's latest jobs, oldest first."""
+    Session = database.get_session_factory()
+    with Session() as session:
+        jobs = session.execute(
+            select(IngestionJob)
+            .where(IngestionJob.chat_id == chat_id)
+            .order_by(IngestionJob.job_id.desc())
+            .limit(limit)
+        ).scalars().all()
+        session.expunge_all()
+    return list(reversed(jobs))
+
+
+def claim(worker_id):
+    """Lease the oldest runnable job to the worker.
+
+    Queued jobs past their `run_after` are runnable, and so are running
+    jobs whose lease expired because their worker died. Returns the
+    claimed `IngestionJob` or None.
+    """
+    runnable = (
+        select(IngestionJob.job_id)
+        .where(
+            or_(
+                and_(IngestionJob.status == Job.QUEUED, IngestionJob.run_after <= db_now),
+                and_(IngestionJob.status == Job.RUNNING, IngestionJob.locked_until < db_now)
+            ),
+            IngestionJob.attempts < config['job_max_attempts']
+        )
+        .order_by(IngestionJob.job_id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    Session = database.get_session_factory()
+    with Session() as session:
+        job = session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.job_id == runnable)
+            .values(
+                status=Job.RUNNING,
+                attempts=IngestionJob.attempts + 1,
+                locked_by=worker_id,
+                locked_until=db_now + timedelta(seconds=config['job_visibility_timeout'])
+            )
+            .returning(IngestionJob)
+        ).scalar_one_or_none()
+        session.commit()
+        if job:
+            session.expunge(job)
+    return job
+
+
+def extend_lease(job_id, worker_id):
+    """Push the job's lease forward; False if another worker took it over."""
+    Session = database.get_session_factory()
+    with Session() as session:
+        result = session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.job_id == job_id, IngestionJob.locked_by == worker_id)
+            .values(locked_until=db_now + timedelta(seconds=config['job_visibility_timeout']))
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def complete(job_id, worker_id):
+    Session = database.get_session_factory()
+    with Session() as session:
+        session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.job_id == job_id, IngestionJob.locked_by == worker_id)
+            .values(status=Job.DONE, error=None, locked_by=None, locked_until=None, finished_at=db_now)
+        )
+        session.commit()
+
+
+TRANSIENT_ERRORS = (
+    exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError,
+    requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError,
+)
+
+
+def is_transient(error):
+    """Whether a job failing with `error` may succeed when retried.
+
+    Database, network, Telegram 429/5xx and Groq 429/5xx errors are
+    transient. Everything else, such as low DPI, too many pages or
+    unparseable documents, would fail again the same way. The pipeline
+    wraps errors in messages for the user, so their causes are checked too.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TRANSIENT_ERRORS) or LLMGateway.is_retryable(error):
+            return True
+        if isinstance(error, ApiTelegramException) and (error.error_code == 429 or error.error_code >= 500):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def fail(job, worker_id, error, permanent=False):
+    """Requeue the job with exponential backoff, or mark it failed when out of
+    attempts or when the error is `permanent`.
+
+    Returns True if the job failed for good.
+    """
+    final = permanent or job.attempts >= config['job_max_attempts']
+    if final:
+        values = {'status': Job.FAILED, 'finished_at': db_now}
+    else:
+        delay = config['job_retry_delay'] * 2 ** (job.attempts - 1)
+        values = {'status': Job.QUEUED, 'run_after': db_now + timedelta(seconds=delay)}
+    Session = database.get_session_factory()
+    with Session() as session:
+        session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.job_id == job.job_id, IngestionJob.locked_by == worker_id)
+            .values(error=str(error), locked_by=None, locked_until=None, **values)
+        )
+        session.commit()
+    return final
+
+
+def fail_abandoned():
+    """Mark jobs whose worker died on their last attempt as failed, returning them."""
+    Session = database.get_session_factory()
+    with Session() as session:
+        jobs = session.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.status == Job.RUNNING,
+                IngestionJob.locked_until < db_now,
+                IngestionJob.attempts >= config['job_max_attempts']
+            )
+            .values(
+                status=Job.FAILED,
+                error="Обработка прервана.",
+                locked_by=None,
+                locked_until=None,
+                finished_at=db_now
+            )
+            .returning(IngestionJob)
+        ).scalars().all()
+        session.commit()
+        session.expunge_all()
+    return jobs
+
+
+class JobWorker:
+    """Threads claiming jobs from the `ingestion_jobs` table.
+
+    `handler(job)` processes one job; `on_failure(job, error)` is called
+    once a job has used up its attempts or failed with an error that
+    retrying cannot fix. While a job runs its lease is
+    renewed in the background, so only crashed workers lose their jobs
+    to others.
+    """
+
+    def __init__(self, handler, on_failure=None, threads=2, poll_interval=1.0):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(
+                target=self._work, args=(f"{self.worker_id}:{i}",), name=f"job-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %s job workers as %s", self.threads, self.worker_id)
+
+    def stop(self):
+        """Stop claiming new jobs and wait for running ones to finish."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stopping.wait(config['job_visibility_timeout']):
+                self._report_abandoned()
+        finally:
+            self.stop()
+
+    def _report_abandoned(self):
+        try:
+            abandoned = fail_abandoned()
+        except Exception as e:
+            logger.error("Could not check for abandoned jobs: %s", e)
+            return
+        for job in abandoned:
+            logger.error("Job %s abandoned after %s attempts", job.job_id, job.attempts)
+            self._notify(job, job.error)
+
+    def _notify(self, job, error):
+        if self.on_failure:
+            try:
+                self.on_failure(job, error)
+            except Exception as callback_error:
+                logger.error("Error reporting failed job %s: %s", job.job_id, callback_error)
+
+    def _work(self, worker_id):
+        while not self._stopping.is_set():
+            try:
+                job = claim(worker_id)
+            except Exception as e:
+                logger.error("Could not claim job: %s", e)
+                job = None
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+            self._run(job, worker_id)
+
+    def _run(self, job, worker_id):
+        logger.info("Worker %s running job %s (attempt %s)", worker_id, job.job_id, job.attempts)
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job.job_id, worker_id, done), daemon=True
+        )
+        heartbeat.start()
+        try:
+            self.handler(job)
+        except Exception as e:
+            permanent = not is_transient(e)
+            logger.error("Job %s failed%s: %s", job.job_id, "" if permanent else ", will retry", e)
+            if fail(job, worker_id, e, permanent):
+                self._notify(job, e)
+        else:
+            complete(job.job_id, worker_id)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id, worker_id, done):
+        interval = config['job_visibility_timeout'] / 3
+        while not done.wait(interval):
+            try:
+                if not extend_lease(job_id, worker_id):
+                    logger.warning("Lost lease on job %s", job_id)
+                    return
+            except Exception as e:
+                logger.error("Could not extend lease on job %s: %s", job_id, e)
@@ -1,71 +1,219 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
-import os
-import time
 
-from groq import Groq, InternalServerError
+from groq import InternalServerError
 
+from app.chunking import estimate_tokens, is_document_json, merge_responses, split_text
 from app.config import Config
+from app.llm_cache import ExtractionCache, version_hash
+from app.llm_gateway import AsyncLLMGateway, LLMGateway
+from app.metrics import errors_total, track_cache
+from app.sessions import SessionStore
 
 
 config = Config.load_config()
 
-log_level_str = config['log_level']
-if log_level_str: 
-    log_level = logging.getLevelName(log_level_str) 
-else: 
-    log_level = logging.getLevelName(logging.INFO)
-
-logging.basicConfig(
-    filename='/workspaces/medtesthelper_bot/log.log',
-    filemode='a',  
-    level=logging.DEBUG,     
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'  
+logger = logging.getLogger(__name__)
+
+_gateway = None
+
+def get_gateway():
+    """Return process-wide LLM gateway, creating it on first use."""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway(
+            api_key=config['groq_token'],
+            model=config['llm_model'],
+            base_url=config['groq_base_url'],
+            max_concurrency=config['llm_max_concurrency'],
+            requests_per_minute=config['llm_requests_per_minute'],
+            tokens_per_minute=config['llm_tokens_per_minute'],
+            max_retries=config['llm_max_retries'],
+            max_tokens=config['llm_output_tokens'],
+            timeout=config['llm_timeout']
+        )
+    return _gateway
+
+_async_gateway = None
+
+def get_async_gateway():
+    """Return process-wide asyncio LLM gateway, creating it on first use."""
+    global _async_gateway
+    if _async_gateway is None:
+        _async_gateway = AsyncLLMGateway(
+            api_key=config['groq_token'],
+            model=config['llm_model'],
+            base_url=config['groq_base_url'],
+            max_concurrency=config['llm_max_concurrency'],
+            requests_per_minute=config['llm_requests_per_minute'],
+            tokens_per_minute=config['llm_tokens_per_minute'],
+            max_retries=config['llm_max_retries'],
+            max_tokens=config['llm_output_tokens'],
+            timeout=config['llm_timeout']
+        )
+    return _async_gateway
+
+chat_sessions = SessionStore(
+    max_sessions=config['chat_sessions_max'],
+    ttl=config['chat_session_ttl'],
+    max_bytes=config['chat_sessions_memory_mb'] * 1024 * 1024,
+    history_tokens=config['chat_history_tokens']
 )
+# Summaries are written after the reply is sent, off the response path
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+summary_tasks = set()
 
-logger = logging.getLogger(__name__)
+def chat_messages(message, summary=None, history=()):
+    messages = [
+        {
+            "role": "system",
+            "content": config['system_prompt']
+        }
+    ]
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": f"Краткое содержание предыдущего разговора: {summary}"
+        })
+    messages.extend(history)
+    messages.append({
+        "role": "user",
+        "content": message,
+    })
+    return messages
 
-RETRIES = 3
+def summary_messages(summary, turns):
+    dialog = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    if summary:
+        dialog = f"Предыдущее краткое содержание: {summary}\n{dialog}"
+    return [
+        {"role": "system", "content": config['summary_prompt']},
+        {"role": "user", "content": dialog}
+    ]
 
-def chat(message):
-    client = Groq(
-    api_key=config['groq_token'],
-    )
+def chat(message, chat_id=None):
+    """Answer the message, continuing the chat's conversation if `chat_id` is given."""
+    context = chat_sessions.context(chat_id) if chat_id is not None else ()
+    try:
+        response = get_gateway().complete(chat_messages(message, *context))
+    except InternalServerError as e:
+        logger.error(f"Error getting response from LLM API: {e}")
+        errors_total.inc(stage='llm')
+        return "Groq: InternalServerError"
+    except Exception as e:
+        logger.error(f"Error getting response from LLM API: {e}")
+        errors_total.inc(stage='llm')
+        return "Groq: Unnown Error"
+
+    if chat_id is not None and chat_sessions.append(chat_id, message, response):
+        summary_executor.submit(summarize, chat_id)
+    return response
 
+def complete_extraction(prompt):
+    """Send an extraction prompt; unlike `chat`, API errors propagate so jobs can retry them."""
     try:
-        chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": config['system_prompt']
-            },
-            {
-                "role": "user",
-                "content": message,
-            }
-        ],
-        model="llama3-groq-70b-8192-tool-use-preview",
-        )
+        return get_gateway().complete(chat_messages(prompt))
+    except Exception:
+        errors_total.inc(stage='llm')
+        raise
 
-        for i in range(RETRIES):
-            try:
-                logger.debug(f"Getting response from LLM API try: {i}")
-                response = chat_completion.choices[0].message.content
+def summarize(chat_id):
+    """Fold turns trimmed from the chat's history into its summary."""
+    summary, turns = chat_sessions.take_pending(chat_id)
+    if not turns:
+        return
+    try:
+        chat_sessions.set_summary(chat_id, get_gateway().complete(summary_messages(summary, turns)))
+    except Exception as e:
+        logger.error(f"Could not summarize chat {chat_id}: {e}")
 
-                return response
-            except Exception as e:
-                logger.error(f"Error getting response from LLM API: {e}")
-                time.sleep(30)
-    except InternalServerError:
+async def chat_async(message, chat_id=None):
+    """asyncio variant of `chat`."""
+    context = chat_sessions.context(chat_id) if chat_id is not None else ()
+    try:
+        response = await get_async_gateway().complete(chat_messages(message, *context))
+    except InternalServerError as e:
+        logger.error(f"Error getting response from LLM API: {e}")
+        errors_total.inc(stage='llm')
         return "Groq: InternalServerError"
-    except:
+    except Exception as e:
+        logger.error(f"Error getting response from LLM API: {e}")
+        errors_total.inc(stage='llm')
         return "Groq: Unnown Error"
 
+    if chat_id is not None and chat_sessions.append(chat_id, message, response):
+        task = asyncio.get_running_loop().create_task(summarize_async(chat_id))
+        summary_tasks.add(task)
+        task.add_done_callback(summary_tasks.discard)
+    return response
+
+async def summarize_async(chat_id):
+    summary, turns = chat_sessions.take_pending(chat_id)
+    if not turns:
+        return
+    try:
+        chat_sessions.set_summary(chat_id, await get_async_gateway().complete(summary_messages(summary, turns)))
+    except Exception as e:
+        logger.error(f"Could not summarize chat {chat_id}: {e}")
+
+
+extraction_cache = track_cache('llm_extraction', ExtractionCache(
+    config['llm_cache_path'],
+    version_hash(config['system_prompt'], config['make_json_prompt'], config['llm_model']),
+    ttl=config['llm_cache_ttl'],
+    max_entries=config['llm_cache_max_entries']
+))
+
+def chunk_budget():
+    """Tokens of document text per extraction request.
+
+    Limited by what is left of the context and by the output budget,
+    since the JSON for a chunk is several times longer than its rows.
+    """
+    context_left = (
+        config['llm_context_tokens']
+        - config['llm_output_tokens']
+        - estimate_tokens(config['system_prompt'])
+        - estimate_tokens(config['make_json_prompt'])
+    )
+    return min(context_left, int(config['llm_output_tokens'] / config['llm_output_ratio']))
 
 def wrap_in_json(text):
+    """Extract document JSON from text, splitting it if it exceeds the context."""
+    chunks = split_text(text, chunk_budget())
+    if len(chunks) == 1:
+        return wrap_chunk_in_json(text)
+
+    logger.info(f"Extracting document in {len(chunks)} chunks")
+    with ThreadPoolExecutor(max_workers=config['llm_max_concurrency']) as executor:
+        responses = list(executor.map(wrap_chunk_in_json, chunks))
+    return merge_responses(responses)
+
+def wrap_chunk_in_json(text):
+    response = extraction_cache.get(text)
+    if response is not None:
+        logger.debug("Extraction cache hit")
+        return response
+
     prompt = f"{config['make_json_prompt']}\n{text}"
-    response = chat(prompt)
+    for attempt in range(config['llm_chunk_retries'] + 1):
+        response = complete_extraction(prompt)
+        if is_document_json(response):
+            break
+        logger.warning(f"Invalid JSON for chunk, attempt {attempt + 1}")
+    cache_extraction(text, response)
     return response
 
+def cache_extraction(text, response):
+    try:
+        json.loads(response)
+    except (TypeError, ValueError):
+        logger.debug("Not caching LLM response that is not valid JSON")
+    else:
+        extraction_cache.put(text, response)
+
 if __name__ == "__main__":
     # Example usage
     message = r"""
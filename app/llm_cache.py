@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting noise maps to the same key."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def version_hash(*parts):
+    """Hash prompt and model so changing either invalidates the cache."""
+    return hashlib.sha256('\x00'.join(parts).encode()).hexdigest()
+
+
+class ExtractionCache:
+    """On-disk SQLite cache of LLM extraction results.
+
+    Entries are keyed by normalized document text and expire after
+    `ttl` seconds. The least recently used entries are evicted once there
+    are more than `max_entries`. Entries written under another prompt
+    version are dropped on open.
+    """
+
+    def __init__(self, path, version, ttl=30 * 24 * 3600, max_entries=10000):
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                " key TEXT PRIMARY KEY,"
+                " version TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_extractions_accessed_at ON extractions (accessed_at)"
+            )
+            deleted = self._conn.execute(
+                "DELETE FROM extractions WHERE version != ?", (version,)
+            ).rowcount
+        if deleted:
+            logger.info("Dropped %s extraction cache entries from older prompt versions", deleted)
+
+    def _key(self, text):
+        return hashlib.sha256(
+            f"{self.version}\x00{normalize_text(text)}".encode()
+        ).hexdigest()
+
+    def get(self, text):
+        """Return cached response for text or None."""
+        key = self._key(text)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._conn.execute(
+                    "UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self.hits += 1
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, text, response):
+        key = self._key(text)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+                (key, self.version, response, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute(
+            "DELETE FROM extractions WHERE created_at < ?", (now - self.ttl,)
+        )
+        self._conn.execute(
+            "DELETE FROM extractions WHERE key IN ("
+            " SELECT key FROM extractions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
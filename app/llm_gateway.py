@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from groq import AsyncGroq, Groq, APIConnectionError, APIStatusError, APITimeoutError
+import httpx
+
+from app.chunking import estimate_tokens as estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages):
+    """Roughly estimate prompt tokens with the estimator used to size chunks."""
+    return sum(estimate_text_tokens(message['content']) for message in messages)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, amount):
+        """Take tokens if available, otherwise return seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        while wait := self._take(amount):
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """Wait without blocking the event loop until tokens are available."""
+        amount = min(amount, self.capacity)
+        while wait := self._take(amount):
+            await asyncio.sleep(wait)
+
+    def adjust(self, amount):
+        """Take `amount` more tokens, or return them if negative, without waiting.
+
+        The balance may go below zero, making later requests wait longer.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class LLMGateway:
+    """Shared Groq client with rate limiting, bounded concurrency and retries.
+
+    Requests are retried with exponential backoff and jitter on 429 and
+    5xx responses, connection errors and timeouts. Other errors are raised
+    immediately. Groq counts prompt and completion tokens against the
+    per-minute limit, so each request reserves its estimated prompt plus
+    `max_tokens`, and the reservation is corrected from the reported usage.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        model,
+        base_url=None,
+        max_concurrency=4,
+        requests_per_minute=30,
+        tokens_per_minute=6000,
+        max_retries=3,
+        max_tokens=None,
+        backoff_base=1.0,
+        backoff_max=30.0,
+        timeout=60
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.max_tokens = max_tokens
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.client = Groq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0, # retries are handled here
+            http_client=httpx.Client(timeout=timeout, limits=self.limits(max_concurrency))
+        )
+
+    @staticmethod
+    def limits(max_concurrency):
+        return httpx.Limits(
+            max_connections=max_concurrency,
+            max_keepalive_connections=max_concurrency
+        )
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (APIConnectionError, APITimeoutError)):
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    def backoff(self, attempt, error=None):
+        """Return seconds to wait before retry number `attempt`."""
+        retry_after = None
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, delay) # full jitter
+
+    def reservation(self, messages, kwargs):
+        """Tokens to reserve for a request, setting its default `max_tokens`."""
+        if self.max_tokens and 'max_tokens' not in kwargs:
+            kwargs['max_tokens'] = self.max_tokens
+        return estimate_tokens(messages) + (kwargs.get('max_tokens') or 0)
+
+    def settle(self, reserved, chat_completion):
+        """Correct the token bucket by the usage Groq reported, if any."""
+        usage = getattr(chat_completion, 'usage', None)
+        if usage and usage.total_tokens is not None:
+            self.tokens.adjust(usage.total_tokens - min(reserved, self.tokens.capacity))
+
+    def complete(self, messages, **kwargs):
+        """Send chat completion request and return response text."""
+        reserved = self.reservation(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            self.requests.acquire()
+            self.tokens.acquire(reserved)
+            try:
+                with self._semaphore:
+                    chat_completion = self.client.chat.completions.create(
+                        messages=messages,
+                        model=self.model,
+                        **kwargs
+                    )
+                self.settle(reserved, chat_completion)
+                return chat_completion.choices[0].message.content
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning(
+                    "LLM request failed (%s), retry %s/%s in %.1f s",
+                    e, attempt + 1, self.max_retries, delay
+                )
+                time.sleep(delay)
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncLLMGateway(LLMGateway):
+    """asyncio variant of `LLMGateway` built on the async Groq client."""
+
+    def __init__(self, api_key, model, base_url=None, max_concurrency=4, timeout=60, **kwargs):
+        super().__init__(
+            api_key, model, base_url=base_url, max_concurrency=max_concurrency,
+            timeout=timeout, **kwargs
+        )
+        self.client.close()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=httpx.AsyncClient(timeout=timeout, limits=self.limits(max_concurrency))
+        )
+
+    async def complete(self, messages, **kwargs):
+        """Send chat completion request and return response text."""
+        reserved = self.reservation(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire_async()
+            await self.tokens.acquire_async(reserved)
+            try:
+                async with self._semaphore:
+                    chat_completion = await self.client.chat.completions.create(
+                        messages=messages,
+                        model=self.model,
+                        **kwargs
+                    )
+                self.settle(reserved, chat_completion)
+                return chat_completion.choices[0].message.content
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning(
+                    "LLM request failed (%s), retry %s/%s in %.1f s",
+                    e, attempt + 1, self.max_retries, delay
+                )
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        await self.client.close()
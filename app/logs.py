@@ -0,0 +1,14 @@
+import logging
+
+from app.config import Config
+
+
+def configure_logging():
+    """Configure root logger from LOG_LEVEL and LOG_FILE (stderr if unset)."""
+    config = Config.load_config()
+    logging.basicConfig(
+        filename=config['log_file'] or None,
+        filemode='a',
+        level=(config['log_level'] or 'INFO').upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
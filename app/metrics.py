@@ -0,0 +1,271 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Monotonic counter; `collect()` may add samples computed at scrape time."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            samples = dict(self._values)
+        if self.collect:
+            for labels, value in self.collect():
+                key = self._key(labels)
+                samples[key] = samples.get(key, 0) + value
+        lines = self.header()
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """Current value, either set directly or read from a function at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._function = None
+
+    def set(self, value):
+        with self._lock:
+            self._values[()] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        lines = self.header()
+        if self._function:
+            try:
+                value = self._function()
+            except Exception as e:
+                logger.debug(f"Could not read gauge {self.name}: {e}")
+                return lines
+        else:
+            with self._lock:
+                if () not in self._values:
+                    return lines
+                value = self._values[()]
+        lines.append(f"{self.name} {format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    """Cumulative histogram of observed durations in seconds."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            samples = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = self.header()
+        bucket_labels = self.labelnames + ('le',)
+        for key, (counts, total) in sorted(samples.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = format_labels(bucket_labels, key + (format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+tracked_caches = {}
+
+def track_cache(name, cache):
+    """Export hits and misses of a cache object with `hits`/`misses` attributes."""
+    tracked_caches[name] = cache
+    return cache
+
+def collect_cache_requests():
+    for name, cache in list(tracked_caches.items()):
+        yield {'cache': name, 'result': 'hit'}, cache.hits
+        yield {'cache': name, 'result': 'miss'}, cache.misses
+
+
+document_stage_seconds = Histogram(
+    'medbot_document_stage_seconds',
+    "Time spent in each stage of document ingestion.",
+    ['stage', 'doc_type', 'data_format']
+)
+message_stage_seconds = Histogram(
+    'medbot_message_stage_seconds',
+    "Time spent in each stage of answering a text message.",
+    ['stage']
+)
+errors_total = Counter(
+    'medbot_errors_total',
+    "Errors by the stage they happened in.",
+    ['stage']
+)
+cache_requests_total = Counter(
+    'medbot_cache_requests_total',
+    "Cache lookups by cache and result.",
+    ['cache', 'result'],
+    collect=collect_cache_requests
+)
+queue_depth = Gauge(
+    'medbot_ingestion_queue_depth',
+    "Documents waiting for an ingestion worker."
+)
+REGISTRY = [document_stage_seconds, message_stage_seconds, errors_total, cache_requests_total, queue_depth]
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+class Trace:
+    """Stage timings of one document.
+
+    Timings are buffered and observed by `finish()` once the document's
+    data format is known, so every stage carries the same labels.
+    """
+
+    def __init__(self, doc_type):
+        self.doc_type = doc_type
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            errors_total.inc(stage=stage)
+            raise
+        finally:
+            self.spans.append((stage, time.perf_counter() - start))
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    def finish(self, data_format=None):
+        for stage, seconds in self.spans:
+            document_stage_seconds.observe(
+                seconds, stage=stage, doc_type=self.doc_type, data_format=data_format or 'unknown'
+            )
+        self.spans = []
+
+
+@contextmanager
+def message_span(stage):
+    """Time a stage of answering a text message, counting its errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(stage=stage)
+        raise
+    finally:
+        message_stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == self.server.metrics_path:
+            body = render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+        elif self.path == '/healthz':
+            body = b'ok'
+            self.send_response(200)
+        else:
+            body = b''
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics %s - %s", self.address_string(), format % args)
+
+
+def serve(host='0.0.0.0', port=80, path='/metrics'):
+    """Serve metrics from a background thread; returns the server or None if the port is taken."""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"Could not serve metrics on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    server.metrics_path = path
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{port}{path}")
+    return server
@@ -1,5 +1,12 @@
-from io import BytesIO
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import logging
+import multiprocessing
+import os
 import pathlib
+import threading
+import time
 
 import cv2
 from PIL import Image as PILImage
@@ -7,58 +14,322 @@ from img2table.ocr import TesseractOCR
 from img2table.document import Image
 from img2table.document import PDF
 import pandas as pd
+import pymupdf
 import pymupdf4llm
 
+from app.cache import LRUCache
 from app.config import Config
+from app.metrics import track_cache
 
 config = Config.load_config()
 
-from app.preprocesssing import preprocess, check_image_dpi
+logger = logging.getLogger(__name__)
+
+from app.preprocesssing import decode_image, preprocess, check_image_dpi
+
+def pool_context():
+    """Start worker processes without forking the multi-threaded bot process."""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
 
 class LowDPIError(Exception):
     """Custom exception for images that don't meet the minimum DPI requirement."""
     pass
 
+class TooManyPagesError(Exception):
+    """Raised for PDFs longer than the configured page limit."""
+    pass
+
+class PDFTimeoutError(Exception):
+    """Raised when PDF conversion stops making progress."""
+    pass
+
 def extract_from_pdf(src):
-    """Extract text from a pdf."""
-    md_text = pymupdf4llm.to_markdown(src)
+    """Extract text from a pdf given as bytes."""
+    with pymupdf.open(stream=src, filetype='pdf') as doc:
+        md_text = pymupdf4llm.to_markdown(doc)
     # pathlib.Path("output.md").write_bytes(md_text.encode()) # save as file
     return md_text
 
 
-def extract_from_image(src):
-    """Extract text from an image."""
-    ocr = TesseractOCR(n_threads=1, 
+def extract_pdf_page(src, page_number):
+    """Extract markdown of a single pdf page."""
+    with pymupdf.open(stream=src, filetype='pdf') as doc:
+        return pymupdf4llm.to_markdown(doc, pages=[page_number])
+
+
+class PDFEngine:
+    """Converts PDF pages to markdown in parallel worker processes.
+
+    Pages are yielded as soon as they are converted, and converted pages
+    are cached by (content hash, page number). If no page finishes within
+    `page_timeout` seconds, at least one running page is stuck, so the pool
+    is torn down and rebuilt.
+    """
+
+    def __init__(self, processes=None, max_pages=30, cache_size=512, page_timeout=60):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pages = max_pages
+        self.page_timeout = page_timeout
+        self.cache = track_cache('pdf_pages', LRUCache(cache_size))
+        self._lock = threading.Lock()
+        self._pool = self._create_pool()
+
+    def _create_pool(self):
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=pool_context())
+
+    def _restart(self, pool):
+        """Kill all workers of `pool` and start a fresh pool, unless another job already did."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            for process in list(pool._processes.values()):
+                process.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._create_pool()
+
+    def iter_pages(self, src, content_hash=None):
+        """Yield (page_number, page_count, markdown) in completion order."""
+        with pymupdf.open(stream=src, filetype='pdf') as doc:
+            page_count = doc.page_count
+        if page_count > self.max_pages:
+            raise TooManyPagesError(
+                f"PDF has {page_count} pages, the limit is {self.max_pages}."
+            )
+
+        pool = self._pool
+        futures = {}
+        for page_number in range(page_count):
+            cached = self.cache.get((content_hash, page_number)) if content_hash else None
+            if cached is not None:
+                yield page_number, page_count, cached
+            else:
+                try:
+                    futures[pool.submit(extract_pdf_page, src, page_number)] = page_number
+                except BrokenProcessPool:
+                    self._restart(pool)
+                    raise
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=self.page_timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                self._restart(pool)
+                raise PDFTimeoutError(f"PDF page took longer than {self.page_timeout} seconds.")
+            for future in done:
+                page_number = futures[future]
+                try:
+                    md_text = future.result()
+                except BrokenProcessPool:
+                    self._restart(pool)
+                    raise
+                if content_hash:
+                    self.cache.put((content_hash, page_number), md_text)
+                yield page_number, page_count, md_text
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def create_ocr(n_threads=1):
+    """Create Tesseract OCR backend for img2table."""
+    return TesseractOCR(n_threads=n_threads, 
                     lang="rus+eng", 
-                    psm=3)      
+                    psm=3)
+
+
+class ArrayImage(Image):
+    """img2table image backed by an already decoded array.
+
+    The original bytes satisfy img2table's source checks, but the
+    preprocessed array is handed to table detection without re-decoding.
+    """
+
+    def __init__(self, src, array, **kwargs):
+        super().__init__(src=src, **kwargs)
+        self._array = array
+
+    @property
+    def images(self):
+        if self._array.ndim == 2:
+            return [cv2.cvtColor(self._array, cv2.COLOR_GRAY2BGR)]
+        return [self._array]
+
+
+def extract_from_image(src, ocr=None, timings=None):
+    """Extract text from image bytes.
+
+    If `timings` is a dict, seconds spent per stage are stored in it.
+    """
+    if ocr is None:
+        ocr = create_ocr()
+    if timings is None:
+        timings = {}
     is_valid_dpi = None
     try:
         min_dpi = config['min_dpi']
-        is_valid_dpi = check_image_dpi(src, min_dpi)
+        start = time.perf_counter()
+        image, dpi = decode_image(src)
+        timings['decode'] = time.perf_counter() - start
+        start = time.perf_counter()
+        is_valid_dpi = check_image_dpi(dpi, min_dpi)
+        timings['dpi_check'] = time.perf_counter() - start
     except Exception as e:
         raise Exception(f"Error: {e}")
     
     if not is_valid_dpi:
         raise LowDPIError(f"Input image is less than {min_dpi} DPI.")
     
-    image = preprocess(src)
-
-    _, buffer = cv2.imencode('.png', image)
-    img_bytes = BytesIO(buffer.tobytes())
-
+    start = time.perf_counter()
+    image = preprocess(image)
+    timings['preprocess'] = time.perf_counter() - start
         
-    doc = Image(img_bytes)
+    doc = ArrayImage(src, image)
 
     # Table extraction
+    start = time.perf_counter()
     extracted_tables = doc.extract_tables(ocr=ocr,
                                         implicit_rows=True,
                                         implicit_columns=True,
                                         borderless_tables=True,
                                         min_confidence=50)
+    timings['table_extract'] = time.perf_counter() - start
 
     return extracted_tables
     
 
+class OCRTimeoutError(Exception):
+    """Raised when an OCR job exceeds its time limit."""
+    pass
+
+
+_worker_ocr = None
+_worker_started = None
+
+def _init_worker(n_threads, started):
+    """Build OCR backend once per worker process."""
+    global _worker_ocr, _worker_started
+    # Keep Tesseract's OpenMP threads within the per-job budget
+    os.environ['OMP_THREAD_LIMIT'] = str(n_threads)
+    _worker_ocr = create_ocr(n_threads)
+    _worker_started = started
+
+
+def _extract_in_worker(job_id, src):
+    _worker_started.put((job_id, os.getpid()))
+    timings = {}
+    tables = extract_from_image(src, ocr=_worker_ocr, timings=timings)
+    return [table.df.to_dict() for table in tables], timings
+
+
+def add_timings(total, timings):
+    """Sum per-stage seconds reported by a worker into `total`."""
+    if total is not None:
+        for stage, seconds in timings.items():
+            total[stage] = total.get(stage, 0.0) + seconds
+
+
+class OCREngine:
+    """Pool of warm worker processes running table extraction.
+
+    Each worker keeps its own Tesseract/img2table setup between jobs. Workers
+    report when they pick up a job, so `timeout` counts only time spent
+    running it, not waiting behind other jobs. A job running over gets its
+    worker killed; the pool replaces it and other jobs keep running.
+    """
+
+    def __init__(self, processes=None, threads_per_job=1, timeout=120, poll_interval=0.2):
+        self.processes = processes or os.cpu_count() or 1
+        self.threads_per_job = threads_per_job
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._jobs = itertools.count()
+        self._running = {} # job id -> (pid, started at) once a worker picked it up, else None
+        context = pool_context()
+        self._started = context.SimpleQueue()
+        self._pool = context.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.threads_per_job, self._started)
+        )
+        threading.Thread(target=self._watch_starts, name='ocr-starts', daemon=True).start()
+
+    def _watch_starts(self):
+        """Record when workers pick up jobs that are still awaited."""
+        while True:
+            message = self._started.get()
+            if message is None:
+                return
+            job_id, pid = message
+            with self._lock:
+                if job_id in self._running:
+                    self._running[job_id] = (pid, time.monotonic())
+
+    def _submit(self, src):
+        job_id = next(self._jobs)
+        with self._lock:
+            self._running[job_id] = None
+        return job_id, self._pool.apply_async(_extract_in_worker, (job_id, src))
+
+    def _wait(self, job_id, result):
+        """Return the job's result, killing its worker once it runs over `timeout`."""
+        while not result.ready():
+            result.wait(self.poll_interval)
+            with self._lock:
+                pid, started = self._running.get(job_id) or (None, None)
+            if started is not None and time.monotonic() - started > self.timeout and not result.ready():
+                self._kill(pid)
+                raise OCRTimeoutError(f"OCR took longer than {self.timeout} seconds.")
+        return result.get()
+
+    def _kill(self, pid):
+        for process in list(self._pool._pool):
+            if process.pid == pid:
+                logger.warning("Killing OCR worker %s after %s seconds", pid, self.timeout)
+                process.terminate()
+
+    def _forget(self, job_ids):
+        with self._lock:
+            for job_id in job_ids:
+                self._running.pop(job_id, None)
+
+    def extract_tables(self, src, timings=None):
+        """Extract tables from image bytes as a list of DataFrame dicts.
+
+        Stage timings measured in the worker are added to `timings`.
+        """
+        job_id, result = self._submit(src)
+        try:
+            tables, worker_timings = self._wait(job_id, result)
+        finally:
+            self._forget([job_id])
+        add_timings(timings, worker_timings)
+        return tables
+
+    def extract_tables_many(self, sources, timings=None):
+        """Extract tables from several images in parallel, keeping input order.
+
+        Worker stage timings are summed over all images into `timings`.
+        """
+        jobs = [self._submit(src) for src in sources]
+        try:
+            results = []
+            for job_id, result in jobs:
+                tables, worker_timings = self._wait(job_id, result)
+                add_timings(timings, worker_timings)
+                results.append(tables)
+            return results
+        finally:
+            self._forget([job_id for job_id, _ in jobs])
+
+    def shutdown(self):
+        # terminate() rather than close(): results of killed jobs never arrive
+        self._pool.terminate()
+        self._pool.join()
+        self._started.put(None)
+
+
 def save_processed_preview(image, extracted_tables):
     """Save processed image preview to inspect recognition quality."""
     table_img = cv2.imread(image)
@@ -77,5 +348,6 @@ if __name__ == "__main__":
     # image = '/workspaces/medtesthelper_bot/data/images/analiz3.jpg'
     # image = '/workspaces/medtesthelper_bot/data/images/diagnostica-1.png'
     
-    tables = extract_from_image(image)
+    with open(image, 'rb') as file:
+        tables = extract_from_image(file.read())
     save_processed_preview(image, tables)
\ No newline at end of file
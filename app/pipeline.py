@@ -0,0 +1,258 @@
+import json
+import logging
+import time
+
+from app.config import Config
+import app.database as database
+import app.dedup as dedup
+from app.llm import wrap_in_json
+from app.metrics import Trace, cache_requests_total
+from app.ocr import OCREngine, PDFEngine
+from app.table_extract import extract_document, tables_from_frames, tables_from_markdown
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TYPES = ['png', 'jpeg', 'jpg']
+
+
+def document_label(doc_types):
+    """Metric label for the uploaded file types: pdf, png, jpg or mixed."""
+    labels = {'jpg' if doc_type == 'jpeg' else doc_type for doc_type in doc_types}
+    return labels.pop() if len(labels) == 1 else 'mixed'
+
+
+def data_format_of(response):
+    try:
+        return json.loads(response).get('data_format')
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class DocumentPipeline:
+    """Download, extract, parse and store uploaded documents.
+
+    `process()` works from Telegram file ids only, so the same pipeline runs in the
+    bot process and in standalone workers. `bot` is a synchronous TeleBot
+    used by `process()` to fetch files and reply to the chat; the async bot
+    passes None and calls `ingest()` with files it downloaded itself.
+    """
+
+    def __init__(self, bot, ocr_engine, pdf_engine):
+        self.bot = bot
+        self.ocr_engine = ocr_engine
+        self.pdf_engine = pdf_engine
+
+    def download(self, file_id):
+        """Download file by its Telegram file id."""
+        file_info = self.bot.get_file(file_id)
+        return self.bot.download_file(file_info.file_path)
+
+    def reply(self, chat_id, message_id, text):
+        self.bot.send_message(chat_id, text, reply_to_message_id=message_id)
+
+    def progress_reporter(self, chat_id, status_message_id, interval=1.0):
+        """Return callback editing the status message with page progress."""
+        last_edit = 0.0
+
+        def report(done, total):
+            nonlocal last_edit
+            now = time.monotonic()
+            if done < total and now - last_edit < interval:
+                return
+            last_edit = now
+            try:
+                self.bot.edit_message_text(
+                    f"Обрабатываю документ: страница {done} из {total}...",
+                    chat_id,
+                    status_message_id
+                )
+            except Exception as e:
+                logger.debug(f"Could not update status message: {e}")
+
+        return report
+
+    def extract_text(self, downloaded_file, doc_type, content_hash=None, on_progress=None, trace=None):
+        """Extract text and tables from downloaded document."""
+        logger.info("Extracting text from document...")
+        trace = trace or Trace(doc_type)
+        doc_text = None
+        tables = []
+        if doc_type == 'pdf':
+            try:
+                start = time.perf_counter()
+                pages = {}
+                for page_number, page_count, md_text in self.pdf_engine.iter_pages(downloaded_file, content_hash):
+                    pages[page_number] = md_text
+                    tables.extend(tables_from_markdown(md_text))
+                    if on_progress:
+                        on_progress(len(pages), page_count)
+                doc_text = "\n".join(pages[number] for number in sorted(pages))
+                trace.add('pdf_markdown', time.perf_counter() - start)
+
+            except Exception as e:
+                raise Exception(f"Error extracting text from file. {e}")
+
+        if doc_type in IMAGE_TYPES:
+            try:
+                timings = {}
+                dicts = self.ocr_engine.extract_tables(downloaded_file, timings)
+                for stage, seconds in timings.items():
+                    trace.add(stage, seconds)
+                if dicts:
+                    doc_text = str(dicts)
+                    tables = tables_from_frames(dicts)
+                else:
+                    doc_text = None
+
+            except Exception as e:
+                raise Exception(f"Error extracting text from file. {e}")
+
+        if not doc_text:
+            raise Exception("Ошибка обработки документа.")
+
+        logger.debug(f"Extracted doc text: {doc_text}")
+        return doc_text, tables
+
+    def extract_album(self, files, doc_types, content_hashes, trace=None):
+        """Extract text and tables from album files, OCR'ing all images in parallel.
+
+        OCR stage timings are summed over the album's images.
+        """
+        trace = trace or Trace(document_label(doc_types))
+        image_indexes = [index for index, doc_type in enumerate(doc_types) if doc_type in IMAGE_TYPES]
+        timings = {}
+        try:
+            frames = self.ocr_engine.extract_tables_many([files[index] for index in image_indexes], timings)
+        except Exception as e:
+            raise Exception(f"Error extracting text from file. {e}")
+        for stage, seconds in timings.items():
+            trace.add(stage, seconds)
+        frames_by_index = dict(zip(image_indexes, frames))
+
+        texts = []
+        tables = []
+        for index, (downloaded_file, doc_type, content_hash) in enumerate(zip(files, doc_types, content_hashes)):
+            if index not in frames_by_index:
+                doc_text, file_tables = self.extract_text(downloaded_file, doc_type, content_hash, trace=trace)
+            elif frames_by_index[index]:
+                doc_text = str(frames_by_index[index])
+                file_tables = tables_from_frames(frames_by_index[index])
+            else:
+                continue
+            texts.append(doc_text)
+            tables.extend(file_tables)
+
+        if not texts:
+            raise Exception("Ошибка обработки документа.")
+        return "\n".join(texts), tables
+
+    def parse_document(self, doc_text, tables, trace=None):
+        """Convert extracted text to document JSON, using the LLM only when needed."""
+        trace = trace or Trace(None)
+        with trace.span('parse_local'):
+            document, confidence = extract_document(doc_text, tables)
+        if document and confidence >= config['table_extract_min_confidence']:
+            logger.info(f"Parsed document locally with confidence {confidence:.2f}")
+            return document.to_json()
+
+        logger.info(f"Local parsing confidence {confidence:.2f}, sending doc text to LLM to parse...")
+        with trace.span('llm'):
+            response = wrap_in_json(doc_text)
+        if not response:
+            raise Exception("Could not get response from LLM.")
+        logger.debug(f"Response json: {response}", )
+        return response
+
+    def process(self, chat_id, message_id, files, status_message_id=None, queued_at=None):
+        """Download uploaded files and store them as a single document.
+
+        `files` is a list of (file_id, doc_type) pairs; several files are an
+        album whose text is combined into one extraction. `queued_at` is the
+        epoch time the job was queued, reported as the queue_wait stage.
+        """
+        file_ids, doc_types = zip(*files)
+        trace = Trace(document_label(doc_types))
+        if queued_at:
+            trace.add('queue_wait', time.time() - queued_at)
+        start = time.perf_counter()
+        data_format = None
+        try:
+            with trace.span('download'):
+                downloaded = [self.download(file_id) for file_id in file_ids]
+            on_progress = None
+            if status_message_id and len(downloaded) == 1:
+                on_progress = self.progress_reporter(chat_id, status_message_id)
+            document_id, data_format = self.ingest(chat_id, downloaded, doc_types, trace, on_progress)
+            self.reply(chat_id, message_id, ingest_reply(document_id))
+            return document_id
+        finally:
+            trace.add('total', time.perf_counter() - start)
+            trace.finish(data_format)
+
+    def ingest(self, chat_id, downloaded, doc_types, trace=None, on_progress=None):
+        """Extract, parse and store downloaded files as one document.
+
+        Shared by the bots and workers, which only differ in how files are
+        downloaded and replies sent. Returns (document_id, data_format);
+        document_id is None if the user already uploaded the same content.
+        """
+        trace = trace or Trace(document_label(doc_types))
+        with trace.span('dedup'):
+            content_hashes = [dedup.hash_content(downloaded_file) for downloaded_file in downloaded]
+            if len(downloaded) == 1:
+                content_hash = content_hashes[0]
+            else:
+                content_hash = dedup.hash_content("".join(content_hashes).encode())
+            upload = dedup.lookup(chat_id, content_hash)
+        cache_requests_total.inc(cache='dedup', result='hit' if upload else 'miss')
+        if upload and upload.telegram_id == chat_id and upload.document_id:
+            logger.info("Document %s was already uploaded", content_hash)
+            return None, data_format_of(upload.parsed_json)
+
+        if upload and upload.parsed_json:
+            logger.info("Reusing cached extraction for %s", content_hash)
+            doc_text = upload.extracted_text
+            response = upload.parsed_json
+        else:
+            with trace.span('extract'):
+                if len(downloaded) == 1:
+                    doc_text, tables = self.extract_text(
+                        downloaded[0], doc_types[0], content_hash, on_progress, trace
+                    )
+                else:
+                    doc_text, tables = self.extract_album(downloaded, doc_types, content_hashes, trace)
+            response = self.parse_document(doc_text, tables, trace)
+
+        logger.info("Trying to add new document to database...")
+        record = lambda document_id: dedup.upsert_upload(chat_id, content_hash, doc_text, response, document_id)
+        try:
+            with trace.span('insert'):
+                document_id = database.add_document(chat_id, response, record)
+        except Exception as e:
+            raise Exception(f"Ошибка при добавлении документа: {e}")
+        with trace.span('dedup'):
+            dedup.evict_payloads()
+        return document_id, data_format_of(response)
+
+
+def ingest_reply(document_id):
+    """Reply to the user once `DocumentPipeline.ingest` returned."""
+    return "Документ успешно добавлен." if document_id else "Этот документ уже добавлен."
+
+
+def create_pipeline(bot=None):
+    """Build pipeline with OCR and PDF worker pools sized from config."""
+    ocr_engine = OCREngine(
+        processes=config['ocr_processes'],
+        threads_per_job=config['ocr_threads'],
+        timeout=config['ocr_timeout']
+    )
+    pdf_engine = PDFEngine(
+        processes=config['pdf_processes'],
+        max_pages=config['pdf_max_pages'],
+        cache_size=config['pdf_page_cache_size'],
+        page_timeout=config['pdf_page_timeout']
+    )
+    return DocumentPipeline(bot, ocr_engine, pdf_engine)
@@ -1,34 +1,38 @@
+from io import BytesIO
+
 import cv2
 import numpy as np
 from PIL import Image 
 
-def threshold(src):
-    """Binarize image using thresholding."""
-    image = cv2.imread(src, cv2.IMREAD_GRAYSCALE)
+def decode_image(data):
+    """Decode image bytes once into a grayscale array and its DPI."""
+    try:
+        with Image.open(BytesIO(data)) as img:
+            dpi = img.info.get('dpi')
+            image = np.asarray(img.convert('L'))
+    except Exception as e:
+        raise Exception(f"Error decoding image: {e}")
+    return image, dpi
+
+
+def threshold(image):
+    """Binarize grayscale image using thresholding."""
     _, thresh = cv2.threshold(image, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    cv2.imwrite('preprocessed_image.png', thresh)  
     return thresh
 
 
-def check_image_dpi(image_path, min_dpi=100):
-    """Check if input image has minimum 300 DPI"""
-    try:
-        with Image.open(image_path) as img:
-            # Get the image DPI
-            dpi = img.info.get('dpi')
-            
-            if dpi:
-                # Check that both DPI values (X and Y) are not less than min_dpi
-                return dpi[0] >= min_dpi and dpi[1] >= min_dpi
-            else:
-                raise Exception(f"Failed to get DPI information for {image_path}")
-    except Exception as e:
-        raise Exception(f"Error opening image {image_path}: {e}")
+def check_image_dpi(dpi, min_dpi=100):
+    """Check if image DPI is at least min_dpi on both axes."""
+    if dpi:
+        # Check that both DPI values (X and Y) are not less than min_dpi
+        return dpi[0] >= min_dpi and dpi[1] >= min_dpi
+    else:
+        raise Exception("Failed to get DPI information for image")
 
 
-def preprocess(src):
+def preprocess(image):
     """Perform preprocessing for OCR."""
-    image = threshold(src)
+    image = threshold(image)
 
     # out_image = Image.fromarray(image) 
     # outimage.save("output_image.png") # save to file 
@@ -36,5 +40,6 @@ def preprocess(src):
 
 
 if __name__ == "__main__":
-    image = '/workspaces/medtesthelper_bot/data/images/analiz.png'
-    preprocess(image)
\ No newline at end of file
+    with open('/workspaces/medtesthelper_bot/data/images/analiz.png', 'rb') as file:
+        image, dpi = decode_image(file.read())
+    preprocess(image)
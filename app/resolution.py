@@ -0,0 +1,70 @@
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.cache import LRUCache
+from app.config import Config
+from app.metrics import track_cache
+from app.schema import User, MedicalInstitution
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+user_ids = track_cache('user_ids', LRUCache(config['resolver_cache_size']))
+institution_ids = track_cache('institution_ids', LRUCache(config['resolver_cache_size']))
+
+
+def user_upsert(telegram_id: int):
+    """INSERT ... ON CONFLICT statement returning the user id."""
+    return (
+        insert(User)
+        .values(telegram_id=telegram_id)
+        .on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={'telegram_id': telegram_id}
+        )
+        .returning(User.user_id)
+    )
+
+
+def institution_upsert(name: str):
+    """INSERT ... ON CONFLICT statement returning the institution id."""
+    return (
+        insert(MedicalInstitution)
+        .values(name=name)
+        .on_conflict_do_update(
+            index_elements=[MedicalInstitution.name],
+            set_={'name': name}
+        )
+        .returning(MedicalInstitution.institution_id)
+    )
+
+
+def resolve_user_id(session: Session, telegram_id: int) -> int:
+    """Return user id for telegram id, creating the user if needed."""
+    user_id = user_ids.get(telegram_id)
+    if user_id is None:
+        user_id = session.execute(user_upsert(telegram_id)).scalar_one()
+        user_ids.put(telegram_id, user_id)
+        logger.debug("Resolved telegram id %s to user %s", telegram_id, user_id)
+    return user_id
+
+
+def resolve_institution_id(session: Session, name: str) -> int:
+    """Return institution id for name, creating the institution if needed."""
+    institution_id = institution_ids.get(name)
+    if institution_id is None:
+        institution_id = session.execute(institution_upsert(name)).scalar_one()
+        institution_ids.put(name, institution_id)
+        logger.debug("Resolved institution %s to %s", name, institution_id)
+    return institution_id
+
+
+def forget(telegram_id: int = None, institution_name: str = None):
+    """Drop cached ids, e.g. when the transaction that created them rolled back."""
+    if telegram_id is not None:
+        user_ids.pop(telegram_id)
+    if institution_name is not None:
+        institution_ids.pop(institution_name)
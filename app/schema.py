@@ -1,5 +1,6 @@
 from datetime import date, datetime
-from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer, String, Text
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, relationship
 
@@ -20,6 +21,10 @@ class MedicalInstitution(Base):
     name = Column(String(255), nullable=False)
     address = Column(Text)
     documents = relationship("MedicalDocument", back_populates="institution")
+    __table_args__ = (
+        # Backs INSERT ... ON CONFLICT (name) upserts
+        Index('uq_medical_institutions_name', 'name', unique=True),
+    )
 
 class MedicalDocument(Base):
     __tablename__ = 'medical_documents'
@@ -33,6 +38,11 @@ class MedicalDocument(Base):
     institution = relationship("MedicalInstitution", back_populates="documents")
     test_data = relationship("TestData", back_populates="document")
     study_data = relationship("StudyData", back_populates="document")
+    __table_args__ = (
+        # Serves per-user lookups by document type and date range
+        Index('ix_medical_documents_user_type_date', 'user_id', 'document_type', 'document_date'),
+        Index('ix_medical_documents_institution_id', 'institution_id'),
+    )
 
 class TestData(Base):
     __tablename__ = 'test_data'
@@ -43,7 +53,16 @@ class TestData(Base):
     unit = Column(String(50))
     range = Column(String(50))
     commentary = Column(Text)
+    # Parsed from value and range on ingestion
+    value_numeric = Column(Float)
+    range_low = Column(Float)
+    range_high = Column(Float)
+    is_abnormal = Column(Boolean)
     document = relationship("MedicalDocument", back_populates="test_data")
+    __table_args__ = (
+        Index('ix_test_data_document_id', 'document_id'),
+        Index('ix_test_data_abnormal_document_id', 'document_id', postgresql_where=is_abnormal.is_(True)),
+    )
 
 class StudyData(Base):
     __tablename__ = 'study_data'
@@ -54,7 +73,119 @@ class StudyData(Base):
     report = Column(Text)
     recommendation = Column(Text)
     document = relationship("MedicalDocument", back_populates="study_data")
+    __table_args__ = (
+        Index('ix_study_data_document_id', 'document_id'),
+    )
+
+class UploadedDocument(Base):
+    """Content-hash index of uploaded files and their extraction results."""
+    __tablename__ = 'uploaded_documents'
+    upload_id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    document_id = Column(Integer, ForeignKey('medical_documents.document_id'))
+    extracted_text = Column(Text)
+    parsed_json = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    accessed_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index('uq_uploaded_documents_user_hash', 'telegram_id', 'content_hash', unique=True),
+        Index('ix_uploaded_documents_content_hash', 'content_hash'),
+        Index('ix_uploaded_documents_accessed_at', 'accessed_at'),
+    )
+
+
+class IngestionJob(Base):
+    """Durable document ingestion job, claimed by workers with SKIP LOCKED."""
+    __tablename__ = 'ingestion_jobs'
+    job_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger)
+    status_message_id = Column(BigInteger)
+    files = Column(Text, nullable=False) # JSON list of [file_id, doc_type]
+    status = Column(String(16), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    locked_by = Column(String(128))
+    locked_until = Column(DateTime)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    __table_args__ = (
+        Index('ix_ingestion_jobs_status_run_after', 'status', 'run_after'),
+        Index('ix_ingestion_jobs_chat_id', 'chat_id'),
+    )
 
 
 def create_tables(engine):
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(engine)
+    added_columns = add_missing_columns(engine)
+    merge_duplicate_institutions(engine)
+    create_indexes(engine)
+    return added_columns
+
+
+def add_missing_columns(engine):
+    """Add columns declared after their table was created.
+
+    Returns the names of added columns as "table.column".
+    """
+    existing_tables = inspect(engine).get_table_names()
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                ))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def merge_duplicate_institutions(engine):
+    """Merge institutions sharing a name so their unique index can be built.
+
+    Documents are repointed at the row with the lowest id, which also gets
+    an address from a duplicate if it had none. Runs until the index exists.
+    """
+    indexes = {index['name'] for index in inspect(engine).get_indexes('medical_institutions')}
+    if 'uq_medical_institutions_name' in indexes:
+        return
+    with engine.begin() as connection:
+        connection.execute(text("LOCK TABLE medical_institutions IN SHARE ROW EXCLUSIVE MODE"))
+        duplicates = """
+            SELECT institution_id, keep_id FROM (
+                SELECT institution_id, min(institution_id) OVER (PARTITION BY name) AS keep_id
+                FROM medical_institutions
+            ) ranked
+            WHERE institution_id <> keep_id
+        """
+        connection.execute(text(f"""
+            UPDATE medical_institutions kept SET address = extra.address
+            FROM ({duplicates}) duplicate
+            JOIN medical_institutions extra ON extra.institution_id = duplicate.institution_id
+            WHERE kept.institution_id = duplicate.keep_id
+              AND kept.address IS NULL AND extra.address IS NOT NULL
+        """))
+        connection.execute(text(f"""
+            UPDATE medical_documents SET institution_id = duplicate.keep_id
+            FROM ({duplicates}) duplicate
+            WHERE medical_documents.institution_id = duplicate.institution_id
+        """))
+        connection.execute(text(f"""
+            DELETE FROM medical_institutions
+            WHERE institution_id IN (SELECT institution_id FROM ({duplicates}) duplicate)
+        """))
+
+
+def create_indexes(engine):
+    """Create indexes missing from tables that existed before they were declared."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
\ No newline at end of file
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+import logging
+import sys
+import threading
+import time
+
+from app.chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession:
+    """Rolling conversation state of one chat."""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.summary = None
+        self.history = [] # [{"role": ..., "content": ...}], oldest first
+        self.pending = [] # turns trimmed from history, not yet in the summary
+        self.history_tokens = 0
+        self.size = 0
+        self.accessed_at = time.monotonic()
+
+    def measure(self):
+        """Approximate memory held by the session's text, in bytes."""
+        texts = [turn['content'] for turn in self.history + self.pending]
+        if self.summary:
+            texts.append(self.summary)
+        self.size = sum(sys.getsizeof(text) for text in texts)
+        return self.size
+
+
+class SessionStore:
+    """Bounded per-chat conversation memory.
+
+    Sessions idle for `ttl` seconds are dropped, at most `max_sessions`
+    are kept, and least recently used sessions are evicted whenever the
+    text held by all sessions exceeds `max_bytes`. Each history is kept
+    under `history_tokens`; trimmed turns wait in `pending` until they
+    are folded into the session summary.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=6 * 3600, max_bytes=64 * 1024 * 1024, history_tokens=1500):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.history_tokens = history_tokens
+        self._sessions = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def context(self, chat_id):
+        """Return (summary, history) to send along with the next message."""
+        with self._lock:
+            session = self._get(chat_id)
+            return session.summary, list(session.history)
+
+    def append(self, chat_id, user_text, reply):
+        """Record one exchange, trimming history to the token budget.
+
+        Returns True when trimmed turns are waiting to be summarized.
+        """
+        with self._lock:
+            session = self._get(chat_id)
+            for role, content in (("user", user_text), ("assistant", reply)):
+                session.history.append({"role": role, "content": content})
+                session.history_tokens += estimate_tokens(content)
+
+            if session.history_tokens > self.history_tokens:
+                # Trim to half the budget so summaries happen once per batch of turns
+                while session.history and (
+                    session.history_tokens > self.history_tokens // 2
+                    or session.history[0]['role'] != 'user'
+                ):
+                    turn = session.history.pop(0)
+                    session.history_tokens -= estimate_tokens(turn['content'])
+                    session.pending.append(turn)
+            self._resize(session)
+            return bool(session.pending)
+
+    def take_pending(self, chat_id):
+        """Hand trimmed turns over for summarization as (summary, turns)."""
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if not session or not session.pending:
+                return None, []
+            turns, session.pending = session.pending, []
+            self._resize(session)
+            return session.summary, turns
+
+    def set_summary(self, chat_id, summary):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session:
+                session.summary = summary
+                self._resize(session)
+
+    def reset(self, chat_id):
+        with self._lock:
+            session = self._sessions.pop(chat_id, None)
+            if session:
+                self._size -= session.size
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    @property
+    def size(self):
+        """Bytes of text held by all sessions."""
+        return self._size
+
+    def _get(self, chat_id):
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(chat_id)
+        if session is None:
+            session = self._sessions[chat_id] = ChatSession(chat_id)
+            while len(self._sessions) > self.max_sessions:
+                self._evict()
+        self._sessions.move_to_end(chat_id)
+        session.accessed_at = now
+        return session
+
+    def _resize(self, session):
+        self._size -= session.size
+        self._size += session.measure()
+        while self._size > self.max_bytes and len(self._sessions) > 1:
+            self._evict()
+
+    def _expire(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.accessed_at < self.ttl:
+                return
+            self._evict()
+
+    def _evict(self):
+        _, session = self._sessions.popitem(last=False)
+        self._size -= session.size
+        logger.debug("Evicted chat session %s", session.chat_id)
@@ -0,0 +1,212 @@
+from datetime import date
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app.document_parse import Document, MedTestDataEntry
+from app.intent import TEST_CATEGORIES
+
+# Header synonyms of lab report columns mapped to data entry fields
+HEADER_SYNONYMS = {
+    'name': r"исследован|показател|наименован|параметр|тест|анализ|test|analyte|parameter|name",
+    'value': r"результат|^значени|result|value",
+    'unit': r"единиц|ед\.|units?$",
+    'range': r"референ|норм|reference|range|interval",
+    'commentary': r"коммент|примечан|comment|note",
+}
+INSTITUTION_PATTERN = (
+    r"\b(ооо|оао|зао|ао|гбуз|гуз|фгбу)\b|клиник|лаборатор|медицинск\w* центр|"
+    r"\bhelix\b|хеликс|инвитро|invitro|гемотест|kdl|кдл|cmd|цмд"
+)
+DATE_PATTERN = r"\b(\d{2})\.(\d{2})\.(\d{4})\b|\b(\d{4})-(\d{2})-(\d{2})\b"
+# Labels looked up in the text just before a date
+BIRTH_DATE_LABEL = r"рожд|\bд\.\s?р\.?|\bдр\b|birth|\bdob\b"
+SAMPLE_DATE_LABEL = r"взят|забор|сбор|образ|поступ|выполн|регистрац|дата анализа|дата исследован|collect|sample"
+DATE_LABEL_WINDOW = 40
+# Panel titles name the document type explicitly, unlike analyte names
+# such as "лейкоциты" that appear in both blood and urine panels
+PANEL_TITLES = [
+    ("анализ крови", r"анализ\w*\s+кров|\bоак\b|гемограм"),
+    ("анализ мочи", r"анализ\w*\s+моч|\bоам\b|\bмоч[аиеуй]\b"),
+    ("копрограмма", r"копрограм|анализ\w*\s+кал"),
+    ("бактериология", r"бактериолог|\bпосев"),
+    ("аллергены", r"аллерг"),
+    ("онкомаркеры", r"онкомаркер"),
+]
+AMBIGUOUS_METADATA_PENALTY = 0.5
+NUMERIC_VALUE = r"^[<>≤≥]?\s*[+-]?\d+([.,]\d+)?"
+
+Table = List[List[str]]
+
+
+def tables_from_markdown(md_text: str) -> List[Table]:
+    """Split pipe tables out of markdown text."""
+    tables, current = [], []
+    for line in md_text.splitlines():
+        line = line.strip()
+        if line.startswith('|') and line.endswith('|'):
+            cells = [cell.strip() for cell in line[1:-1].split('|')]
+            if all(re.fullmatch(r":?-{3,}:?", cell) for cell in cells if cell):
+                continue # header separator
+            current.append(cells)
+        elif current:
+            tables.append(current)
+            current = []
+    if current:
+        tables.append(current)
+    return tables
+
+
+def tables_from_frames(frames: List[Dict]) -> List[Table]:
+    """Convert img2table DataFrame dicts ({column: {row: value}}) to rows."""
+    tables = []
+    for frame in frames:
+        columns = list(frame.values())
+        if not columns:
+            continue
+        row_keys = list(columns[0].keys())
+        tables.append([
+            ['' if column.get(key) is None else str(column.get(key)).strip() for column in columns]
+            for key in row_keys
+        ])
+    return tables
+
+
+def map_header(row: List[str]) -> Dict[str, int]:
+    """Map entry fields to column indexes by header synonyms."""
+    mapping = {}
+    for index, cell in enumerate(row):
+        cell = cell.lower().replace('ё', 'е').replace('<br>', ' ')
+        for field, pattern in HEADER_SYNONYMS.items():
+            if field not in mapping and cell and re.search(pattern, cell):
+                mapping[field] = index
+                break
+    return mapping
+
+
+def extract_entries(table: Table) -> Tuple[List[MedTestDataEntry], int]:
+    """Extract test entries from a table.
+
+    Returns the entries and the number of candidate rows they came from,
+    so callers can judge how much of the table was understood.
+    """
+    for header_index, row in enumerate(table[:3]):
+        mapping = map_header(row)
+        if 'name' in mapping and 'value' in mapping:
+            break
+    else:
+        return [], 0
+
+    def cell(row, field):
+        index = mapping.get(field)
+        if index is None or index >= len(row):
+            return ''
+        return row[index].replace('<br>', ' ').strip()
+
+    entries, candidates = [], 0
+    for row in table[header_index + 1:]:
+        if not any(row):
+            continue
+        name, value = cell(row, 'name'), cell(row, 'value')
+        if name and not value:
+            continue # section title such as "Клинический анализ крови"
+        candidates += 1
+        if name and value:
+            entries.append(MedTestDataEntry(
+                name, value, cell(row, 'unit'), cell(row, 'range'), cell(row, 'commentary')
+            ))
+    return entries, candidates
+
+
+def find_document_type(text: str) -> Tuple[str, bool]:
+    """Return the document type and whether it was determined unambiguously.
+
+    An explicit panel title wins over analyte keywords; when several
+    titles or keyword categories match, the earliest is returned as
+    ambiguous.
+    """
+    text = text.lower().replace('ё', 'е')
+    for categories in (PANEL_TITLES, TEST_CATEGORIES):
+        found = []
+        for document_type, pattern in categories:
+            match = re.search(pattern, text)
+            if match:
+                found.append((match.start(), document_type))
+        if found:
+            return min(found)[1], len(found) == 1
+    return "другое", False
+
+
+def find_document_date(text: str) -> Tuple[str, bool]:
+    """Return the ISO sampling date and whether it was determined unambiguously.
+
+    Dates labelled as birth dates are skipped and dates labelled as sample
+    or collection dates are preferred. Otherwise the first date is used,
+    which is unambiguous only when the text has no other date.
+    """
+    labelled, other = [], []
+    for match in re.finditer(DATE_PATTERN, text):
+        day, month, year, iso_year, iso_month, iso_day = match.groups()
+        try:
+            if year:
+                found = date(int(year), int(month), int(day)).isoformat()
+            else:
+                found = date(int(iso_year), int(iso_month), int(iso_day)).isoformat()
+        except ValueError:
+            continue
+        label = text[max(0, match.start() - DATE_LABEL_WINDOW):match.start()].lower()
+        # Only the label closest to the date counts
+        label = re.split(r"[\n|;]|\d{2}\.\d{2}\.\d{4}|\d{4}-\d{2}-\d{2}", label)[-1]
+        if re.search(BIRTH_DATE_LABEL, label):
+            continue
+        (labelled if re.search(SAMPLE_DATE_LABEL, label) else other).append(found)
+
+    if labelled:
+        return labelled[0], len(set(labelled)) == 1
+    if other:
+        return other[0], len(set(other)) == 1
+    return "", False
+
+
+def find_institution(text: str) -> str:
+    for line in text.splitlines():
+        line = line.strip(' |#*')
+        if line and len(line) <= 120 and re.search(INSTITUTION_PATTERN, line.lower()):
+            return line
+    return ""
+
+
+def extract_document(text: str, tables: List[Table]) -> Tuple[Optional[Document], float]:
+    """Build a test Document from recognized lab tables without the LLM.
+
+    Returns the document (or None) and a confidence score in [0, 1]:
+    the share of candidate rows that yielded an entry with a numeric-like
+    value, scaled down for very small tables and for documents whose type
+    or date could not be determined unambiguously.
+    """
+    entries, candidates = [], 0
+    for table in tables:
+        table_entries, table_candidates = extract_entries(table)
+        entries.extend(table_entries)
+        candidates += table_candidates
+
+    if not entries:
+        return None, 0.0
+
+    numeric = sum(1 for entry in entries if re.match(NUMERIC_VALUE, entry.value))
+    confidence = (len(entries) / candidates) * (0.5 + 0.5 * numeric / len(entries))
+    if len(entries) < 3:
+        confidence *= 0.5
+
+    document_type, type_certain = find_document_type(text)
+    document_date, date_certain = find_document_date(text)
+    if not (type_certain and date_certain):
+        confidence *= AMBIGUOUS_METADATA_PENALTY
+
+    document = Document(
+        data_format="test",
+        institution_name=find_institution(text),
+        document_type=document_type,
+        document_date=document_date,
+        data=entries
+    )
+    return document, confidence
@@ -0,0 +1,189 @@
+from io import BytesIO
+import logging
+import re
+from typing import Optional, Tuple
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from app.cache import LRUCache
+from app.config import Config
+import app.database as database
+from app.metrics import track_cache
+from app.schema import MedicalDocument, TestData, User
+
+config = Config.load_config()
+
+logger = logging.getLogger(__name__)
+
+trend_cache = track_cache('trends', LRUCache(config['trend_cache_size']))
+
+RUSSIAN_ENDINGS = r"(ами|ями|ого|его|ому|ему|ах|ях|ов|ев|ей|ом|ем|ой|ий|ый|ая|а|я|ы|и|у|ю|е)$"
+
+
+class AmbiguousAnalyteError(Exception):
+    """The analyte matches several differently named tests."""
+
+    def __init__(self, names):
+        super().__init__(f"Найдено несколько показателей: {', '.join(names)}")
+        self.names = names
+
+
+def analyte_stem(analyte: str) -> str:
+    """Strip a case ending so "гемоглобина" matches "гемоглобин"."""
+    analyte = analyte.strip().lower().replace('ё', 'е')
+    if len(analyte) > 5:
+        analyte = re.sub(RUSSIAN_ENDINGS, '', analyte)
+    return analyte
+
+
+def normalize_name(name: str) -> str:
+    """Name key shared by spellings of one analyte, e.g. "Гемоглобин (HGB)" and "гемоглобин"."""
+    name = re.sub(r"\(.*?\)", " ", name.lower().replace('ё', 'е'))
+    return " ".join(re.sub(r"[^\w%-]+", " ", name).split())
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def data_version(session, telegram_id: int) -> Tuple:
+    """Cheap fingerprint of the user's stored documents."""
+    return session.execute(
+        select(func.max(MedicalDocument.document_id), func.count(MedicalDocument.document_id))
+        .join(User, MedicalDocument.user_id == User.user_id)
+        .where(User.telegram_id == telegram_id)
+    ).one()
+
+
+def fetch_analyte_history(session, telegram_id: int, stem: str) -> pd.DataFrame:
+    """Load numeric history of one analyte for the user in a single query."""
+    rows = session.execute(
+        select(
+            MedicalDocument.document_date.label('date'),
+            TestData.name,
+            TestData.value_numeric.label('value'),
+            TestData.unit,
+            TestData.range_low.label('low'),
+            TestData.range_high.label('high'),
+        )
+        .select_from(MedicalDocument)
+        .join(User, MedicalDocument.user_id == User.user_id)
+        .join(TestData, TestData.document_id == MedicalDocument.document_id)
+        .where(
+            User.telegram_id == telegram_id,
+            TestData.name.ilike(f"%{escape_like(stem)}%", escape='\\'),
+            TestData.value_numeric.isnot(None)
+        )
+        .order_by(MedicalDocument.document_date, TestData.data_id)
+    ).all()
+    return pd.DataFrame(rows, columns=['date', 'name', 'value', 'unit', 'low', 'high'])
+
+
+def select_analyte(history: pd.DataFrame, stem: str) -> pd.DataFrame:
+    """Keep rows of the single analyte the stem refers to.
+
+    A substring match can hit several analytes, e.g. "гемоглобин" and
+    "гликированный гемоглобин". An exact name match wins; otherwise
+    AmbiguousAnalyteError lists the candidates.
+    """
+    keys = history['name'].map(normalize_name)
+    candidates = list(dict.fromkeys(keys))
+    if len(candidates) > 1:
+        exact = [key for key in candidates if key == stem or analyte_stem(key) == stem]
+        if len(exact) != 1:
+            latest_names = history.groupby(keys)['name'].last()
+            raise AmbiguousAnalyteError([latest_names[key] for key in candidates])
+        candidates = exact
+    return history[keys == candidates[0]].reset_index(drop=True)
+
+
+def compute_trend(history: pd.DataFrame, window: int = 3) -> pd.DataFrame:
+    """Add deltas, rolling stats and out-of-range run lengths."""
+    trend = history.copy()
+    trend['date'] = pd.to_datetime(trend['date'])
+    trend['delta'] = trend['value'].diff()
+    trend['pct_change'] = trend['value'].pct_change() * 100
+    trend['rolling_mean'] = trend['value'].rolling(window, min_periods=1).mean()
+    trend['rolling_std'] = trend['value'].rolling(window, min_periods=2).std()
+
+    low = trend['low'].to_numpy(dtype=float)
+    high = trend['high'].to_numpy(dtype=float)
+    values = trend['value'].to_numpy(dtype=float)
+    out_of_range = (values < np.nan_to_num(low, nan=-np.inf)) | (values > np.nan_to_num(high, nan=np.inf))
+    trend['out_of_range'] = out_of_range
+
+    # Length of the current run of consecutive in- or out-of-range results
+    run_id = (trend['out_of_range'] != trend['out_of_range'].shift()).cumsum()
+    trend['run_length'] = trend.groupby(run_id).cumcount() + 1
+    return trend
+
+
+def summarize(trend: pd.DataFrame) -> str:
+    last = trend.iloc[-1]
+    name = last['name']
+    unit = last['unit'] or ''
+    lines = [
+        f"{name}: {len(trend)} измерений с {trend['date'].iloc[0]:%Y-%m-%d} по {last['date']:%Y-%m-%d}",
+        f"Последнее значение: {last['value']:g} {unit}",
+        f"Минимум: {trend['value'].min():g}, максимум: {trend['value'].max():g}, "
+        f"среднее: {trend['value'].mean():.2f}",
+    ]
+    if len(trend) > 1:
+        lines.append(f"Изменение с прошлого раза: {last['delta']:+g} {unit} ({last['pct_change']:+.1f}%)")
+    out_of_range = int(trend['out_of_range'].sum())
+    if out_of_range:
+        lines.append(f"Вне референсного диапазона: {out_of_range} из {len(trend)}")
+    if last['out_of_range']:
+        lines.append(f"Последние {last['run_length']} результата подряд вне нормы")
+    return "\n".join(lines)
+
+
+def render_chart(trend: pd.DataFrame) -> bytes:
+    """Render the history as a PNG chart."""
+    fig, ax = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        ax.plot(trend['date'], trend['value'], marker='o', label='значение')
+        ax.plot(trend['date'], trend['rolling_mean'], linestyle='--', label='скользящее среднее')
+        if trend['low'].notna().any() or trend['high'].notna().any():
+            ax.fill_between(
+                trend['date'],
+                trend['low'].fillna(trend['value'].min()),
+                trend['high'].fillna(trend['value'].max()),
+                alpha=0.15, label='норма'
+            )
+        abnormal = trend[trend['out_of_range']]
+        ax.scatter(abnormal['date'], abnormal['value'], color='red', zorder=3)
+        ax.set_title(trend['name'].iloc[-1])
+        ax.set_ylabel(trend['unit'].iloc[-1] or '')
+        ax.legend()
+        fig.autofmt_xdate()
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def analyte_trend(telegram_id: int, analyte: str) -> Optional[Tuple[str, bytes]]:
+    """Return (summary, PNG chart) of the analyte's history, or None if there is no data."""
+    stem = analyte_stem(analyte)
+    Session = database.get_session_factory()
+    with Session() as session:
+        key = (telegram_id, stem, tuple(data_version(session, telegram_id)))
+        cached = trend_cache.get(key)
+        if cached is not None:
+            logger.debug("Trend cache hit for %s", key)
+            return cached
+        history = fetch_analyte_history(session, telegram_id, stem)
+
+    if history.empty:
+        return None
+    trend = compute_trend(select_analyte(history, stem))
+    result = summarize(trend), render_chart(trend)
+    trend_cache.put(key, result)
+    return result
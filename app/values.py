@@ -0,0 +1,72 @@
+import re
+from typing import Optional, Tuple
+
+NUMBER = r"[+-]?\d+(?:[.,]\d+)?"
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Parse a number written with a dot or comma decimal separator."""
+    if not text:
+        return None
+    match = re.search(NUMBER, text.replace(' ', ''))
+    if not match:
+        return None
+    return float(match.group(0).replace(',', '.'))
+
+
+def parse_value(text: str) -> Optional[float]:
+    """Parse numeric test result such as "7.42", "13,2" or "<0.5"."""
+    if not text:
+        return None
+    text = text.strip()
+    if not re.match(r"^[<>≤≥]?\s*" + NUMBER, text):
+        return None # textual results like "отрицательно"
+    return parse_number(text)
+
+
+def parse_range(text: str) -> Tuple[Optional[float], Optional[float]]:
+    """Parse reference range into (low, high).
+
+    Handles "4.5 - 11", "13,2-17,3", "<15", "до 15", ">60", "от 60".
+    Unknown bounds are None.
+    """
+    if not text:
+        return None, None
+    text = text.strip().lower().replace('–', '-').replace('—', '-')
+
+    match = re.search(rf"({NUMBER})\s*-\s*({NUMBER})", text)
+    if match:
+        low = parse_number(match.group(1))
+        high = parse_number(match.group(2))
+        if low is not None and high is not None and low > high:
+            low, high = high, low
+        return low, high
+
+    match = re.search(rf"(<|≤|<=|до|менее|меньше)\s*({NUMBER})", text)
+    if match:
+        return None, parse_number(match.group(2))
+
+    match = re.search(rf"(>|≥|>=|от|более|больше)\s*({NUMBER})", text)
+    if match:
+        return parse_number(match.group(2)), None
+
+    return None, None
+
+
+def is_abnormal(value: Optional[float], low: Optional[float], high: Optional[float]) -> Optional[bool]:
+    """Whether value lies outside the range, or None if it cannot be told."""
+    if value is None or (low is None and high is None):
+        return None
+    return (low is not None and value < low) or (high is not None and value > high)
+
+
+def parse_test_values(value: str, ref_range: str) -> dict:
+    """Return numeric columns of a test data row."""
+    value_numeric = parse_value(value)
+    range_low, range_high = parse_range(ref_range)
+    return {
+        'value_numeric': value_numeric,
+        'range_low': range_low,
+        'range_high': range_high,
+        'is_abnormal': is_abnormal(value_numeric, range_low, range_high)
+    }
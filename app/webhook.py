@@ -0,0 +1,114 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import logging
+import secrets
+
+from telebot.types import Update
+
+import app.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """HTTP ingress for Telegram updates.
+
+    Updates are acknowledged as soon as they are read and validated, then
+    handed to the bot, whose worker threads run the handlers concurrently.
+    The server keeps no state between requests, so several instances can
+    run behind a load balancer. If `metrics_path` is set, GET requests to it
+    return the process metrics.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bot, host='0.0.0.0', port=80, path='/telegram', secret_token=None, metrics_path=None):
+        super().__init__((host, port), WebhookHandler)
+        self.bot = bot
+        self.webhook_path = path
+        self.secret_token = secret_token
+        self.metrics_path = metrics_path
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            self._respond(200, b'ok')
+        elif self.server.metrics_path and self.path == self.server.metrics_path:
+            self._respond(200, metrics.render(), metrics.CONTENT_TYPE)
+        else:
+            self._respond(404)
+
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self._respond(404)
+            return
+
+        secret = self.server.secret_token
+        if not secret or not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), secret):
+            logger.warning("Rejected webhook request with invalid secret token")
+            self._respond(403)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            length = -1
+        if length <= 0:
+            self._respond(400)
+            return
+        if length > MAX_BODY_SIZE:
+            self._respond(413)
+            return
+        try:
+            update = Update.de_json(json.loads(self.rfile.read(length)))
+        except Exception as e:
+            logger.error(f"Invalid webhook update: {e}")
+            self._respond(400)
+            return
+
+        # Acknowledge before handling, Telegram only needs the 200
+        self._respond(200)
+        self.server.bot.process_new_updates([update])
+
+    def _respond(self, status, body=b'', content_type=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook %s - %s", self.address_string(), format % args)
+
+
+def run_webhook(bot, url, host, port, path, secret_token, metrics_path=None):
+    """Register webhook with Telegram and serve updates until interrupted.
+
+    Requests are only accepted with the secret token. Without WEBHOOK_SECRET
+    a random one is registered with Telegram, which works for a single
+    instance; several instances need a shared WEBHOOK_SECRET.
+    """
+    if not secret_token:
+        if not url:
+            raise ValueError("WEBHOOK_SECRET is required when the webhook is registered outside the bot.")
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET is not set, using a random secret token for this process")
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url.rstrip('/') + path, secret_token=secret_token)
+        logger.info(f"Registered webhook {url.rstrip('/') + path}")
+    server = WebhookServer(bot, host, port, path, secret_token, metrics_path)
+    logger.info(f"Serving webhook on {host}:{port}{path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,77 @@
+"""Measure ingestion throughput of the ORM and bulk document insert paths.
+
+Run against a local Postgres configured through `.env`:
+    python -m benchmarks.bulk_insert --rows 60 --documents 50
+"""
+import argparse
+from datetime import date
+import time
+
+from sqlalchemy import delete, select
+
+import app.database as database
+from app.document_parse import MedTestDataEntry
+from app.schema import MedicalDocument, TestData, User
+
+BENCH_TELEGRAM_ID = 999000001
+
+
+def make_panel(rows):
+    return [
+        MedTestDataEntry(f"analyte {i}", f"{i}.5", "г/дл", "1.0-10.0", "")
+        for i in range(rows)
+    ]
+
+
+def measure(add_func, entries, documents):
+    Session = database.get_session_factory()
+    start = time.perf_counter()
+    for _ in range(documents):
+        with Session() as session:
+            add_func(
+                session,
+                telegram_id=BENCH_TELEGRAM_ID,
+                institution_name="benchmark clinic",
+                document_type="анализ крови",
+                document_date=date.today(),
+                data_format="test",
+                data_entries=entries
+            )
+    return time.perf_counter() - start
+
+
+def cleanup():
+    Session = database.get_session_factory()
+    with Session() as session:
+        document_ids = select(MedicalDocument.document_id).join(User).where(
+            User.telegram_id == BENCH_TELEGRAM_ID
+        )
+        session.execute(delete(TestData).where(TestData.document_id.in_(document_ids)))
+        session.execute(delete(MedicalDocument).where(MedicalDocument.document_id.in_(document_ids)))
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=60)
+    parser.add_argument('--documents', type=int, default=50)
+    args = parser.parse_args()
+
+    database.create_database_tables()
+    entries = make_panel(args.rows)
+    total_rows = args.rows * args.documents
+    try:
+        for label, add_func in (
+            ("orm", database.add_medical_document),
+            ("bulk", database.add_medical_document_bulk),
+        ):
+            elapsed = measure(add_func, entries, args.documents)
+            print(f"{label:<5} {total_rows} rows in {elapsed:6.2f} s  "
+                  f"{total_rows / elapsed:10.0f} rows/sec")
+    finally:
+        cleanup()
+        database.dispose_engine()
+
+
+if __name__ == "__main__":
+    main()
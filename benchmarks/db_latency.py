@@ -0,0 +1,61 @@
+"""Compare per-query latency of a fresh engine per call against the shared pool.
+
+Run against a local Postgres configured through `.env`:
+    python -m benchmarks.db_latency --queries 200
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import app.database as database
+
+
+def run_query(Session):
+    with Session() as session:
+        session.execute(text("SELECT 1")).scalar()
+
+
+def fresh_engine_query():
+    """Previous behaviour: new engine and sessionmaker on every call."""
+    engine = database.create_database_engine()
+    Session = sessionmaker(bind=engine)
+    run_query(Session)
+    engine.dispose()
+
+
+def pooled_query():
+    run_query(database.get_session_factory())
+
+
+def measure(func, queries):
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<14} mean {statistics.mean(timings):8.2f} ms  "
+          f"median {statistics.median(timings):8.2f} ms  p95 {p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    pooled_query() # warm up the pool
+    report("fresh engine", measure(fresh_engine_query, args.queries))
+    report("pooled", measure(pooled_query, args.queries))
+    database.dispose_engine()
+
+
+if __name__ == "__main__":
+    main()
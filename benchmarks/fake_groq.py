@@ -0,0 +1,112 @@
+"""Local stand-in for the Groq chat completions API.
+
+Serves canned OpenAI-style chat completions and can inject failures so
+retries and rate limiting can be exercised without network access:
+    python -m benchmarks.fake_groq --port 8081 --fail-first 2 --fail-status 429
+    GROQ_BASE_URL=http://127.0.0.1:8081 GROQ_TOKEN=fake python app.py
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import threading
+import time
+
+CANNED_CONTENT = json.dumps({
+    "data_format": "test",
+    "institution_name": "fake clinic",
+    "document_type": "анализ крови",
+    "document_date": "2024-08-22",
+    "data": [
+        {"name": "гемоглобин", "value": "14.8", "unit": "г/дл", "range": "13.2 - 17.3", "commentary": ""},
+        {"name": "лейкоциты", "value": "6.72", "unit": "тыс/мкл", "range": "4.5 - 11", "commentary": ""}
+    ]
+}, ensure_ascii=False)
+
+
+class FakeGroqServer(ThreadingHTTPServer):
+    """HTTP server answering POST /openai/v1/chat/completions."""
+
+    daemon_threads = True
+
+    def __init__(self, address, content=CANNED_CONTENT, latency=0.0, fail_first=0, fail_status=500):
+        super().__init__(address, FakeGroqHandler)
+        self.content = content
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = itertools.count(1)
+        self.received = []
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread and return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        request = json.loads(body or b'{}')
+        self.server.received.append(request)
+        number = next(self.server.requests)
+        time.sleep(self.server.latency)
+
+        if number <= self.server.fail_first:
+            self._send(self.server.fail_status, {"error": {"message": "injected failure"}},
+                       headers={'retry-after': '0'})
+            return
+
+        self._send(200, {
+            "id": f"chatcmpl-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', ''),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.server.content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-first', type=int, default=0)
+    parser.add_argument('--fail-status', type=int, default=500)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(
+        ('127.0.0.1', args.port),
+        latency=args.latency,
+        fail_first=args.fail_first,
+        fail_status=args.fail_status
+    )
+    print(f"Fake Groq listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measure extraction latency against document size with chunked requests.
+
+Runs wrap_in_json against the local fake Groq server, so it measures
+chunking, concurrency and merging overhead with a fixed per-request latency:
+    python -m benchmarks.llm_chunking --latency 1.0 --rows 50 200 800
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fake_groq import FakeGroqServer
+
+
+def make_panel(rows):
+    lines = [
+        "МедОк ООО",
+        "Дата взятия образца: 22.08.2024",
+        "|Исследование|Результат|Единицы|Референсные значения|",
+        "|---|---|---|---|",
+    ]
+    lines += [f"|Показатель {i}|{i}.{i % 10}|г/л|{i} - {i + 10}|" for i in range(rows)]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=1.0, help="fake server seconds per request")
+    parser.add_argument('--rows', type=int, nargs='+', default=[25, 100, 400, 1600])
+    args = parser.parse_args()
+
+    server = FakeGroqServer(('127.0.0.1', 0), latency=args.latency).start()
+    os.environ['GROQ_BASE_URL'] = server.base_url
+    os.environ.setdefault('GROQ_TOKEN', 'fake')
+    os.environ['LLM_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'llm_cache.sqlite3')
+    os.environ['LLM_REQUESTS_PER_MINUTE'] = '100000'
+    os.environ['LLM_TOKENS_PER_MINUTE'] = '100000000'
+
+    from app.chunking import estimate_tokens, split_text
+    from app.llm import chunk_budget, wrap_in_json
+
+    print(f"{'rows':>6} {'tokens':>8} {'chunks':>6} {'seconds':>8}")
+    for rows in args.rows:
+        text = make_panel(rows)
+        chunks = len(split_text(text, chunk_budget()))
+        start = time.perf_counter()
+        wrap_in_json(text)
+        elapsed = time.perf_counter() - start
+        print(f"{rows:>6} {estimate_tokens(text):>8} {chunks:>6} {elapsed:>8.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Per-stage latency of the document pipeline on synthetic lab reports.
+
+Stages run on generated images (one per DPI) and PDFs, against the local
+fake Groq server and the Postgres configured through `.env`. Results are
+written to benchmarks/results/ and compared with the previous run:
+    python -m benchmarks.pipeline --repeat 20
+    python -m benchmarks.pipeline --stages decode threshold --dpi 300 --skip-db
+    python -m benchmarks.pipeline --baseline benchmarks/results/20240901T120000.json --fail-on-regression
+"""
+import argparse
+from datetime import date, datetime, timezone
+import gc
+import glob
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+from benchmarks.fake_groq import CANNED_CONTENT, FakeGroqServer
+from benchmarks.synthetic import render_image, render_pdf, report_rows
+
+BENCH_TELEGRAM_ID = 999000002
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+STAGES = ['decode', 'dpi_check', 'threshold', 'table_extract', 'pdf_markdown', 'llm', 'insert', 'query']
+
+
+def measure(func, repeat, warmup=1):
+    """Time `func()` and return robust statistics in milliseconds.
+
+    The garbage collector is paused while timing so collections triggered
+    by earlier stages do not land in a single sample.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    samples.sort()
+    median = statistics.median(samples)
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [median] * 3
+    return {
+        'n': len(samples),
+        'median_ms': median,
+        'mean_ms': statistics.fmean(samples),
+        'stdev_ms': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'iqr_ms': quartiles[2] - quartiles[0],
+        'min_ms': samples[0],
+        'p95_ms': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        'max_ms': samples[-1],
+    }
+
+
+def configure_environment(server):
+    """Point the app at the fake LLM and a throwaway extraction cache."""
+    os.environ['GROQ_BASE_URL'] = server.base_url
+    os.environ.setdefault('GROQ_TOKEN', 'fake')
+    os.environ['LLM_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'llm_cache.sqlite3')
+    os.environ['LLM_REQUESTS_PER_MINUTE'] = '1000000'
+    os.environ['LLM_TOKENS_PER_MINUTE'] = '1000000000'
+
+
+def image_stages(args, results):
+    from app.config import Config
+    from app.ocr import extract_from_image
+    from app.preprocesssing import check_image_dpi, decode_image, threshold
+
+    min_dpi = Config.load_config()['min_dpi']
+    rows = report_rows(args.rows)
+    for dpi in args.dpi:
+        data = render_image(rows, dpi)
+        image, image_dpi = decode_image(data)
+        label = f"dpi={dpi}"
+        if 'decode' in args.stages:
+            results[f"decode[{label}]"] = measure(lambda: decode_image(data), args.repeat)
+        if 'dpi_check' in args.stages:
+            results[f"dpi_check[{label}]"] = measure(lambda: check_image_dpi(image_dpi, min_dpi), args.repeat)
+        if 'threshold' in args.stages:
+            results[f"threshold[{label}]"] = measure(lambda: threshold(image), args.repeat)
+        if 'table_extract' in args.stages:
+            if dpi < min_dpi:
+                print(f"skipping table_extract[{label}]: below MIN_DPI={min_dpi}")
+                continue
+            results[f"table_extract[{label}]"] = measure(
+                lambda: extract_from_image(data), args.ocr_repeat, warmup=0
+            )
+
+
+def pdf_stages(args, results):
+    from app.ocr import extract_from_pdf
+
+    rows = report_rows(args.rows)
+    for pages in args.pages:
+        data = render_pdf(rows, pages)
+        results[f"pdf_markdown[pages={pages}]"] = measure(lambda: extract_from_pdf(data), args.repeat)
+
+
+def llm_stage(args, results):
+    from app.llm import wrap_in_json
+
+    # Unique text per call so the extraction cache never answers
+    counter = itertools.count()
+    text = "\n".join(" ".join(row) for row in report_rows(args.rows))
+    results[f"llm[latency={args.llm_latency}]"] = measure(
+        lambda: wrap_in_json(f"{next(counter)}\n{text}"), args.repeat
+    )
+
+
+def database_stages(args, results):
+    from sqlalchemy import delete, select
+
+    import app.database as database
+    from app.schema import MedicalDocument, TestData, User
+
+    try:
+        database.create_database_tables()
+    except Exception as e:
+        print(f"skipping insert and query: database unavailable ({e})")
+        return
+
+    try:
+        if 'insert' in args.stages:
+            results["insert"] = measure(
+                lambda: database.add_document(BENCH_TELEGRAM_ID, CANNED_CONTENT), args.repeat
+            )
+        if 'query' in args.stages:
+            if 'insert' not in args.stages:
+                for _ in range(args.repeat):
+                    database.add_document(BENCH_TELEGRAM_ID, CANNED_CONTENT)
+            start_date, end_date = '2000-01-01', date.today().isoformat()
+            results["query[page]"] = measure(
+                lambda: database.fetch_page(BENCH_TELEGRAM_ID, 'test', None, start_date, end_date),
+                args.repeat
+            )
+            results["query[abnormal]"] = measure(
+                lambda: database.fetch_page(BENCH_TELEGRAM_ID, 'test', None, start_date, end_date, abnormal=True),
+                args.repeat
+            )
+    finally:
+        Session = database.get_session_factory()
+        with Session() as session:
+            document_ids = select(MedicalDocument.document_id).join(User).where(
+                User.telegram_id == BENCH_TELEGRAM_ID
+            )
+            session.execute(delete(TestData).where(TestData.document_id.in_(document_ids)))
+            session.execute(delete(MedicalDocument).where(MedicalDocument.document_id.in_(document_ids)))
+            session.commit()
+        database.dispose_engine()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latest_result():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')))
+    return paths[-1] if paths else None
+
+
+def compare(results, baseline, tolerance):
+    """Print medians against the baseline and return names of regressed stages.
+
+    A stage regresses when its median grew by more than `tolerance` and by
+    more than the combined interquartile range, so noisy stages need a
+    clear shift before they are flagged.
+    """
+    regressions = []
+    print(f"{'stage':<28} {'median ms':>10} {'iqr ms':>8} {'baseline':>10} {'change':>8}")
+    for name, stats in results.items():
+        old = baseline.get(name)
+        line = f"{name:<28} {stats['median_ms']:>10.2f} {stats['iqr_ms']:>8.2f}"
+        if old:
+            change = stats['median_ms'] / old['median_ms'] - 1 if old['median_ms'] else 0.0
+            noise = stats['iqr_ms'] + old['iqr_ms']
+            regressed = change > tolerance and stats['median_ms'] - old['median_ms'] > noise
+            line += f" {old['median_ms']:>10.2f} {change:>+7.1%}"
+            if regressed:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--ocr-repeat', type=int, default=3, help="repeats for the slow table_extract stage")
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 300, 600])
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="fake server seconds per request")
+    parser.add_argument('--skip-db', action='store_true')
+    parser.add_argument('--baseline', help="results file to compare with (default: previous run)")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed median slowdown, 0.10 = 10%%")
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    server = FakeGroqServer(('127.0.0.1', 0), latency=args.llm_latency).start()
+    configure_environment(server)
+
+    results = {}
+    if {'decode', 'dpi_check', 'threshold', 'table_extract'} & set(args.stages):
+        image_stages(args, results)
+    if 'pdf_markdown' in args.stages:
+        pdf_stages(args, results)
+    if 'llm' in args.stages:
+        llm_stage(args, results)
+    if not args.skip_db and {'insert', 'query'} & set(args.stages):
+        database_stages(args, results)
+    server.shutdown()
+
+    baseline_path = args.baseline or latest_result()
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)['stages']
+        print(f"Comparing with {baseline_path}")
+    regressions = compare(results, baseline, args.tolerance)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S') + '.json')
+        with open(path, 'w') as file:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'args': vars(args),
+                'stages': results,
+            }, file, indent=2)
+        print(f"Saved results to {path}")
+
+    if regressions and args.fail_on_regression:
+        raise SystemExit(f"Regressed stages: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
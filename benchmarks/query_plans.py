@@ -0,0 +1,132 @@
+"""Seed a synthetic dataset and check that hot queries use index scans.
+
+Run against a local (disposable) Postgres configured through `.env`:
+    python -m benchmarks.query_plans --users 2000 --documents 20 --rows 30
+
+Exits with a non-zero status if any hot query plans a sequential scan on
+a table that should be reached through an index.
+"""
+import argparse
+from datetime import date, timedelta
+import json
+import random
+import sys
+
+from sqlalchemy import delete, insert, select, text
+
+import app.database as database
+from app.schema import MedicalDocument, MedicalInstitution, StudyData, TestData, User
+
+FIRST_TELEGRAM_ID = 900000000
+DOCUMENT_TYPES = ["анализ крови", "анализ мочи", "копрограмма", "узи", "томография"]
+
+
+def seed(session, users, documents, rows):
+    """Insert synthetic users with documents; returns (user ids, institution id) to clean up."""
+    institution_id = session.execute(
+        insert(MedicalInstitution).values(name="synthetic clinic")
+        .returning(MedicalInstitution.institution_id)
+    ).scalar_one()
+    user_ids = session.execute(
+        insert(User).returning(User.user_id),
+        [{'telegram_id': FIRST_TELEGRAM_ID + i} for i in range(users)]
+    ).scalars().all()
+
+    start = date(2015, 1, 1)
+    for user_id in user_ids:
+        document_ids = session.execute(
+            insert(MedicalDocument).returning(MedicalDocument.document_id),
+            [{
+                'user_id': user_id,
+                'institution_id': institution_id,
+                'document_type': random.choice(DOCUMENT_TYPES),
+                'document_date': start + timedelta(days=random.randrange(3650))
+            } for _ in range(documents)]
+        ).scalars().all()
+        session.execute(insert(TestData), [
+            {'document_id': document_id, 'name': f"analyte {i}", 'value': str(i), 'is_abnormal': i % 10 == 0}
+            for document_id in document_ids for i in range(rows)
+        ])
+        session.execute(insert(StudyData), [
+            {'document_id': document_id, 'device': "device", 'result': "result"}
+            for document_id in document_ids
+        ])
+    session.commit()
+    session.execute(text("ANALYZE"))
+    return user_ids, institution_id
+
+
+def cleanup(session, user_ids, institution_id):
+    """Delete only the rows created by `seed`."""
+    documents = select(MedicalDocument.document_id).where(MedicalDocument.user_id.in_(user_ids))
+    session.execute(delete(TestData).where(TestData.document_id.in_(documents)))
+    session.execute(delete(StudyData).where(StudyData.document_id.in_(documents)))
+    session.execute(delete(MedicalDocument).where(MedicalDocument.user_id.in_(user_ids)))
+    session.execute(delete(User).where(User.user_id.in_(user_ids)))
+    session.execute(delete(MedicalInstitution).where(MedicalInstitution.institution_id == institution_id))
+    session.commit()
+
+
+def hot_queries():
+    """Queries issued by fetch_data_by_period, keyed by a readable label."""
+    telegram_id = FIRST_TELEGRAM_ID + 1
+    queries = {
+        query_type: database.build_period_query(
+            telegram_id, query_type, "анализ крови", "2020-01-01", "2020-12-31"
+        )
+        for query_type in ("test", "study")
+    }
+    queries["abnormal"] = database.build_period_query(
+        telegram_id, "test", None, "2020-01-01", "2020-12-31", abnormal=True
+    )
+    return queries
+
+
+def scanned_relations(plan):
+    """Yield (node type, relation name) for every node of a JSON plan."""
+    yield plan.get('Node Type'), plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from scanned_relations(child)
+
+
+def check_plan(session, label, query):
+    compiled = query.compile(session.get_bind(), compile_kwargs={'literal_binds': True})
+    raw = session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+    plan = (raw if isinstance(raw, list) else json.loads(raw))[0]['Plan']
+    seq_scans = [
+        relation for node_type, relation in scanned_relations(plan)
+        if node_type == 'Seq Scan'
+    ]
+    if seq_scans:
+        print(f"FAIL {label}: sequential scan on {', '.join(seq_scans)}")
+        return False
+    print(f"ok   {label}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=30)
+    args = parser.parse_args()
+
+    database.create_database_tables()
+    Session = database.get_session_factory()
+    with Session() as session:
+        # Fails on existing telegram ids before anything is committed
+        seeded = seed(session, args.users, args.documents, args.rows)
+        try:
+            results = [
+                check_plan(session, label, query)
+                for label, query in hot_queries().items()
+            ]
+        finally:
+            session.rollback()
+            cleanup(session, *seeded)
+    database.dispose_engine()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
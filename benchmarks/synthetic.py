@@ -0,0 +1,124 @@
+"""Synthetic lab reports rendered as images and PDFs for benchmarks.
+
+The same report rows are drawn at any DPI, so image size scales the way a
+real scan would while the content stays fixed:
+    python -m benchmarks.synthetic --out /tmp/reports --dpi 150 300 600
+"""
+import argparse
+import io
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+import pymupdf
+
+HEADER = ["Исследование", "Результат", "Единицы", "Референсные значения"]
+ANALYTES = [
+    ("Гемоглобин", "г/дл", 13.2, 17.3),
+    ("Гематокрит", "%", 39.0, 49.0),
+    ("Эритроциты", "млн/мкл", 4.3, 5.7),
+    ("Лейкоциты", "тыс/мкл", 4.5, 11.0),
+    ("Тромбоциты", "тыс/мкл", 150.0, 400.0),
+    ("Нейтрофилы", "%", 48.0, 78.0),
+    ("Лимфоциты", "%", 19.0, 37.0),
+    ("Моноциты", "%", 3.0, 11.0),
+    ("СОЭ", "мм/ч", 2.0, 15.0),
+    ("Глюкоза", "ммоль/л", 3.9, 6.1),
+]
+FONT_CANDIDATES = [
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+]
+
+
+def report_rows(rows=10, seed=0):
+    """Return table rows (name, value, unit, range) with reproducible values."""
+    rng = random.Random(seed)
+    result = []
+    for i in range(rows):
+        name, unit, low, high = ANALYTES[i % len(ANALYTES)]
+        if i >= len(ANALYTES):
+            name = f"{name} {i // len(ANALYTES) + 1}"
+        value = rng.uniform(low * 0.8, high * 1.2)
+        result.append((name, f"{value:.1f}", unit, f"{low:g} - {high:g}"))
+    return result
+
+
+def load_font(size):
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def render_image(rows, dpi=300, fmt='PNG'):
+    """Draw the report on an A5 page at `dpi` and return encoded image bytes."""
+    scale = dpi / 72
+    width, height = int(420 * scale), int(595 * scale)
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = load_font(max(int(9 * scale), 8))
+
+    margin = int(24 * scale)
+    row_height = int(18 * scale)
+    columns = [margin, int(150 * scale), int(220 * scale), int(290 * scale), width - margin]
+    draw.text((margin, margin), "МедОк ООО   Дата взятия образца: 22.08.2024", font=font, fill=0)
+
+    top = margin + 2 * row_height
+    for number, cells in enumerate([HEADER] + [list(row) for row in rows]):
+        y = top + number * row_height
+        for x, cell in zip(columns, cells):
+            draw.text((x + 4, y + 3), cell, font=font, fill=0)
+        draw.line([(columns[0], y), (columns[-1], y)], fill=0, width=max(int(scale), 1))
+    bottom = top + (len(rows) + 1) * row_height
+    draw.line([(columns[0], bottom), (columns[-1], bottom)], fill=0, width=max(int(scale), 1))
+    for x in columns:
+        draw.line([(x, top), (x, bottom)], fill=0, width=max(int(scale), 1))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+
+def render_pdf(rows, pages=1):
+    """Build a text PDF with the report table repeated on every page."""
+    cells = "".join(
+        "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows
+    )
+    html = (
+        "<p>МедОк ООО. Дата взятия образца: 22.08.2024</p>"
+        "<table border='1'><tr>" + "".join(f"<th>{cell}</th>" for cell in HEADER) + "</tr>"
+        f"{cells}</table>"
+    )
+    doc = pymupdf.open()
+    for _ in range(pages):
+        page = doc.new_page(width=420, height=595)
+        page.insert_htmlbox(pymupdf.Rect(24, 24, 396, 571), html)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 300, 600])
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--pages', type=int, default=2)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    rows = report_rows(args.rows)
+    for dpi in args.dpi:
+        with open(os.path.join(args.out, f"report_{dpi}dpi.png"), 'wb') as file:
+            file.write(render_image(rows, dpi))
+    with open(os.path.join(args.out, f"report_{args.pages}p.pdf"), 'wb') as file:
+        file.write(render_pdf(rows, args.pages))
+
+
+if __name__ == "__main__":
+    main()
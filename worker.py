@@ -0,0 +1,46 @@
+from datetime import timezone
+import json
+
+import telebot
+
+from app.config import Config
+import app.database as database
+import app.jobs as jobs
+from app.logs import configure_logging
+import app.metrics as metrics
+from app.pipeline import create_pipeline
+
+
+def main():
+    """Process ingestion jobs queued by the bot; run as many copies as needed."""
+    configure_logging()
+    config = Config.load_config()
+    bot = telebot.TeleBot(config['bot_token'])
+    database.create_database_tables()
+    pipeline = create_pipeline(bot)
+
+    def handle(job):
+        queued_at = job.created_at.replace(tzinfo=timezone.utc).timestamp()
+        pipeline.process(job.chat_id, job.message_id, json.loads(job.files), job.status_message_id, queued_at)
+
+    def report_failure(job, error):
+        bot.send_message(
+            job.chat_id,
+            f"Ошибка обработки документа: {error}",
+            reply_to_message_id=job.message_id
+        )
+
+    metrics.queue_depth.set_function(jobs.depth)
+    if config['metrics_enabled']:
+        metrics.serve(config['webhook_host'], config['metrics_port'], config['metrics_path'])
+
+    worker = jobs.JobWorker(
+        handle,
+        on_failure=report_failure,
+        threads=config['ingestion_workers'],
+        poll_interval=config['job_poll_interval']
+    )
+    worker.run_forever()
+
+if __name__ == "__main__":
+    main()